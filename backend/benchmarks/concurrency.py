@@ -0,0 +1,102 @@
+"""
+Throughput of a running API at increasing numbers of in-flight requests.
+
+    python benchmarks/concurrency.py http://127.0.0.1:8000 --token <JWT>
+
+With a non-blocking request path, requests per second should keep growing
+with concurrency until an upstream (WMS, Mistral, database) saturates.
+Every answered question counts against the user's monthly quota, so point
+it at a test database.
+
+Each request asks a different question (or a different point), since
+identical requests in flight share one upstream call and would measure that
+instead of throughput.
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+
+QUESTION = {
+    "question": "Que tipo de construção é permitida neste local?",
+    "properties": {
+        "PDM:QUALIFICACAO": [
+            {"abstract": "PDM 2021", "classe": "Área de Frente Urbana Contínua"}
+        ]
+    },
+    "coords": {
+        "lat": 41.1496,
+        "lon": -8.6109,
+        "margin": 0.001,
+        "municipality": "Porto",
+    },
+    "fresh": True,
+}
+PROPERTIES = QUESTION["coords"]
+# Two properties cache cells apart, so each point is a cache miss
+POINT_SPACING = 0.0002
+
+# Numbers requests across levels, so no level reuses an earlier one's answers
+request_numbers = itertools.count()
+
+
+def ask_payload(number):
+    return {**QUESTION, "question": f"{QUESTION['question']} (pedido {number})"}
+
+
+def properties_payload(number):
+    return {**PROPERTIES, "lon": PROPERTIES["lon"] + number * POINT_SPACING}
+
+
+async def run_level(client, path, make_payload, concurrency, requests):
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(next(request_numbers))
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            number = queue.get_nowait()
+            response = await client.post(path, json=make_payload(number))
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start), errors
+
+
+async def main(args):
+    path, make_payload = {
+        "ask": ("/ask_question/", ask_payload),
+        "properties": ("/get_properties/", properties_payload),
+    }[args.endpoint]
+
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=120,
+        limits=httpx.Limits(max_connections=max(args.levels)),
+    ) as client:
+        print(f"{'in flight':>10} {'req/s':>10} {'errors':>8}")
+        for concurrency in args.levels:
+            throughput, errors = await run_level(
+                client, path, make_payload, concurrency, args.requests
+            )
+            print(f"{concurrency:>10} {throughput:>10.1f} {errors:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("url")
+    parser.add_argument(
+        "--token", required=True, help="JWT signed with NEXTAUTH_SECRET"
+    )
+    parser.add_argument("--endpoint", choices=["ask", "properties"], default="ask")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,138 @@
+"""
+Local stand-in for the Mistral API (embeddings and chat, streamed or not).
+
+Embeddings are deterministic unit vectors derived from a hash of the text,
+so retrieval is repeatable. Point the backend at it with MISTRAL_SERVER_URL.
+
+    python benchmarks/fake_mistral.py --port 9200 --chat-latency 1.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+EMBEDDING_DIMENSION = 1024
+ANSWER = (
+    "De acordo com o **Artigo 18.º**, nas Áreas de Frente Urbana Contínua "
+    "Consolidada admite-se a construção de edifícios destinados a habitação, "
+    "comércio e serviços, mantendo o alinhamento das fachadas existentes.\n\n"
+    "O **Artigo 20.º** estabelece que a altura da fachada não pode exceder a "
+    "moda da frente edificada do lado do arruamento onde se integra."
+)
+
+
+def fake_embedding(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSION)
+    return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+
+def usage(prompt_tokens, completion_tokens=0):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_app(embed_latency=0.05, chat_latency=1.0, token_delay=0.01):
+    """
+    Args:
+        embed_latency: Seconds per embeddings request.
+        chat_latency: Seconds to a complete answer, or to the first streamed token.
+        token_delay: Seconds between streamed tokens.
+    """
+    app = FastAPI()
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        await asyncio.sleep(embed_latency)
+        return {
+            "id": uuid.uuid4().hex,
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": usage(sum(len(text) // 3 for text in inputs)),
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        completion_id = uuid.uuid4().hex
+        created = int(time.time())
+        prompt_tokens = sum(
+            len(str(m.get("content", ""))) // 3 for m in body["messages"]
+        )
+        await asyncio.sleep(chat_latency)
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": ANSWER},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage(prompt_tokens, len(ANSWER) // 3),
+            }
+
+        async def chunks():
+            words = ANSWER.split(" ")
+            for i, word in enumerate(words):
+                last = i == len(words) - 1
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": word if last else word + " "},
+                            "finish_reason": "stop" if last else None,
+                        }
+                    ],
+                }
+                if last:
+                    chunk["usage"] = usage(prompt_tokens, len(ANSWER) // 3)
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Mistral API for benchmarks.")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.embed_latency, args.chat_latency, args.token_delay),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+    )
@@ -0,0 +1,86 @@
+"""
+Local stand-in for a municipality's GeoServer WMS.
+
+Serves the recorded GetCapabilities document and GetFeatureInfo results in
+fixtures/, single- or multi-layer like GeoServer, after a configurable delay.
+
+    python benchmarks/fake_wms.py --port 9100 --latency 0.08
+"""
+
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class FakeWMS(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, FakeWMSHandler)
+        self.latency = latency
+        self.base_url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        with open(os.path.join(FIXTURES_DIR, "capabilities.xml")) as f:
+            self.capabilities = f.read().replace("{base_url}", self.base_url).encode()
+        with open(os.path.join(FIXTURES_DIR, "feature_info.json")) as f:
+            self.feature_info = json.load(f)
+
+    def features_for(self, layers):
+        features = []
+        for layer in layers:
+            short_name = layer.split(":")[-1]
+            for i, properties in enumerate(self.feature_info.get(layer, []), start=1):
+                features.append(
+                    {
+                        "type": "Feature",
+                        "id": f"{short_name}.{i}",
+                        "geometry": None,
+                        "properties": dict(properties),
+                    }
+                )
+        return {"type": "FeatureCollection", "features": features}
+
+
+class FakeWMSHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        query = {
+            key.lower(): values[0]
+            for key, values in parse_qs(urlsplit(self.path).query).items()
+        }
+        request = query.get("request", "")
+        if request == "GetCapabilities":
+            body, content_type = server.capabilities, "application/vnd.ogc.wms_xml"
+        elif request == "GetFeatureInfo":
+            time.sleep(server.latency)
+            layers = query.get("query_layers", "").split(",")
+            body = json.dumps(server.features_for(layers)).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(400, "Unsupported request")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake WMS for benchmarks.")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument(
+        "--latency", type=float, default=0.08, help="GetFeatureInfo delay (s)"
+    )
+    args = parser.parse_args()
+    server = FakeWMS(("127.0.0.1", args.port), args.latency)
+    print(f"Fake WMS on {server.base_url}/wms")
+    server.serve_forever()
@@ -0,0 +1,148 @@
+"""
+Size, build time, query latency and recall@k of every FAISS index type.
+
+Reads the vectors of an existing exact index (the Porto article embeddings
+by default), builds each index type from them and compares its results
+with exact search, for queries made by perturbing sampled vectors:
+
+    python benchmarks/index_types.py --k 5 --queries 200
+
+--replicate grows the corpus with noisy copies of the vectors, to see how
+the types behave on a corpus the size of several municipalities. Run it
+from the backend directory.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from helpers.faiss_index import (  # noqa: E402
+    FAISS_EF_SEARCH,
+    FAISS_NPROBE,
+    INDEX_TYPES,
+    build_index,
+    configure_search,
+    factory_string,
+)
+
+
+def load_vectors(index_path, replicate, noise, rng):
+    index = faiss.read_index(index_path)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    copies = [vectors] + [
+        perturb(vectors, noise, rng) for _ in range(max(replicate, 1) - 1)
+    ]
+    return np.ascontiguousarray(np.concatenate(copies), dtype=np.float32)
+
+
+def perturb(vectors, noise, rng):
+    # Gaussian noise of about the given norm, vectors kept at their scale
+    scale = noise / np.sqrt(vectors.shape[1])
+    return (vectors + rng.normal(0, scale, vectors.shape)).astype(np.float32)
+
+
+def recall_at_k(found, expected):
+    k = expected.shape[1]
+    return float(np.mean([len(set(f) & set(e)) / k for f, e in zip(found, expected)]))
+
+
+def measure(index_type, vectors, queries, expected, args):
+    start = time.perf_counter()
+    index = build_index(vectors, index_type)
+    build_seconds = time.perf_counter() - start
+    configure_search(index, args.nprobe, args.ef_search)
+
+    # One query at a time, as the API searches
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], args.k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+
+    start = time.perf_counter()
+    index.search(queries, args.k)
+    batch_seconds = time.perf_counter() - start
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {
+        "index_type": index_type,
+        "factory": factory_string(index_type, *vectors.shape),
+        "size_bytes": int(faiss.serialize_index(index).size),
+        "build_s": build_seconds,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "batch_qps": len(queries) / batch_seconds,
+        f"recall@{args.k}": recall_at_k(np.array(found), expected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare FAISS index types against exact search."
+    )
+    parser.add_argument(
+        "--index",
+        default=os.path.join(BACKEND_DIR, "data", "artigos_embeddings.faiss"),
+        help="Exact index whose vectors are used",
+    )
+    parser.add_argument(
+        "--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES)
+    )
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--noise", type=float, default=0.1, help="Norm of the query perturbation"
+    )
+    parser.add_argument(
+        "--replicate", type=int, default=1, help="Noisy copies of the corpus"
+    )
+    parser.add_argument("--nprobe", type=int, default=FAISS_NPROBE)
+    parser.add_argument("--ef-search", type=int, default=FAISS_EF_SEARCH)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = load_vectors(args.index, args.replicate, args.noise, rng)
+    sample = rng.choice(len(vectors), size=args.queries, replace=True)
+    queries = np.ascontiguousarray(perturb(vectors[sample], args.noise, rng))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, expected = exact.search(queries, args.k)
+
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}")
+    recall = f"recall@{args.k}"
+    print(
+        f"{'type':<10}{'factory':<18}{'size KiB':>10}{'build s':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'batch q/s':>11}{recall:>11}"
+    )
+    results = []
+    for index_type in args.types:
+        result = measure(index_type, vectors, queries, expected, args)
+        results.append(result)
+        print(
+            f"{index_type:<10}{result['factory']:<18}"
+            f"{result['size_bytes'] / 1024:>10.0f}{result['build_s']:>9.2f}"
+            f"{result['p50_ms']:>9.3f}{result['p95_ms']:>9.3f}"
+            f"{result['batch_qps']:>11.0f}{result[recall]:>11.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
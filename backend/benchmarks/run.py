@@ -0,0 +1,300 @@
+"""
+Benchmark every API endpoint against local stand-ins for its dependencies.
+
+Starts the fake WMS, the fake Mistral API and the backend (on SQLite unless
+--database-url is given), drives each endpoint at every concurrency level
+and reports latency percentiles and throughput:
+
+    python benchmarks/run.py --concurrency 1 8 32 --requests 200
+
+Run it from the backend directory. Use --json to keep the numbers for
+comparing before and after a change.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from jose import jwt
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+SECRET = "benchmark-secret"
+MUNICIPALITY = "Porto"
+LAYER = "PDM:QUALIFICACAO_SOLO"
+QUESTION = "Que tipo de construção é permitida neste local?"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def token(user_id):
+    return jwt.encode({"id": user_id}, SECRET, algorithm="HS256")
+
+
+def location_properties():
+    """What /get_properties/ returns for the fixture location."""
+    with open(os.path.join(BENCHMARKS_DIR, "fixtures", "feature_info.json")) as f:
+        features = json.load(f)
+    return {
+        layer: [dict(p, abstract="PDM 2021", nome=layer) for p in properties]
+        for layer, properties in features.items()
+    }
+
+
+def coords(i=0):
+    # Spread requests over a few hundred cells so caches see hits and misses
+    return {
+        "lat": 41.1496 + (i % 20) * 0.0005,
+        "lon": -8.6109 + (i // 20 % 20) * 0.0005,
+        "margin": 0.001,
+        "municipality": MUNICIPALITY,
+    }
+
+
+def question(i, fresh=True):
+    return {
+        "question": f"{QUESTION} ({i})" if fresh else QUESTION,
+        "properties": location_properties(),
+        "coords": coords(),
+        "fresh": fresh,
+    }
+
+
+# name -> function(i) returning (method, path, user_id, json body)
+ENDPOINTS = {
+    "properties": lambda i: ("POST", "/get_properties/", "bench", coords(i)),
+    "ask": lambda i: ("POST", "/ask_question/", f"bench-ask-{i}", question(i)),
+    "ask_cached": lambda i: (
+        "POST",
+        "/ask_question/",
+        f"bench-cached-{i}",
+        question(i, fresh=False),
+    ),
+    "ask_stream": lambda i: (
+        "POST",
+        "/ask_question/stream",
+        f"bench-stream-{i}",
+        question(i),
+    ),
+    "responses": lambda i: ("GET", "/responses/", "bench-history", None),
+    "request_count": lambda i: ("GET", "/request_count/", "bench-history", None),
+    "layers": lambda i: ("GET", f"/layers/{MUNICIPALITY}", "bench", None),
+    "layer_info": lambda i: ("GET", f"/layer_info/{LAYER}", "bench", None),
+    "metrics": lambda i: ("GET", "/metrics", None, None),
+}
+
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def start_services(args, workdir):
+    wms_port, mistral_port, api_port = free_port(), free_port(), free_port()
+
+    with open(os.path.join(BACKEND_DIR, "data", "municipalities_configs.json")) as f:
+        config = json.load(f)
+    porto = config[MUNICIPALITY]
+    porto["wms_url"] = f"http://127.0.0.1:{wms_port}/wms"
+    porto["wms_version"] = "1.1.1"
+    for key in ("index_path", "chunks_path"):
+        if key in porto:
+            porto[key] = os.path.join(BACKEND_DIR, porto[key])
+    config_path = os.path.join(workdir, "municipalities_configs.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url
+        or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        NEXTAUTH_SECRET=SECRET,
+        MISTRAL_API_KEY="benchmark",
+        MISTRAL_SERVER_URL=f"http://127.0.0.1:{mistral_port}",
+        MUNICIPALITIES_CONFIG_PATH=config_path,
+        EMBEDDING_CACHE_PATH="",
+        LOG_LEVEL="WARNING",
+    )
+
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BENCHMARKS_DIR, "fake_wms.py"),
+                "--port",
+                str(wms_port),
+                "--latency",
+                str(args.wms_latency),
+            ]
+        ),
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BENCHMARKS_DIR, "fake_mistral.py"),
+                "--port",
+                str(mistral_port),
+                "--embed-latency",
+                str(args.embed_latency),
+                "--chat-latency",
+                str(args.chat_latency),
+                "--token-delay",
+                str(args.token_delay),
+            ]
+        ),
+    ]
+    wait_until_up(f"http://127.0.0.1:{wms_port}/", processes[0])
+    wait_until_up(f"http://127.0.0.1:{mistral_port}/", processes[1])
+
+    processes.append(
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--port",
+                str(api_port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=BACKEND_DIR,
+            env=env,
+        )
+    )
+    wait_until_up(f"http://127.0.0.1:{api_port}/metrics", processes[2])
+
+    return f"http://127.0.0.1:{api_port}", processes
+
+
+async def timed_request(client, endpoint, i):
+    method, path, user_id, body = ENDPOINTS[endpoint](i)
+    headers = {"Authorization": f"Bearer {token(user_id)}"} if user_id else {}
+    start = time.perf_counter()
+    # Streamed answers only count once the last event has arrived
+    async with client.stream(method, path, json=body, headers=headers) as response:
+        await response.aread()
+    return time.perf_counter() - start, response.status_code
+
+
+async def run_level(client, endpoint, concurrency, requests):
+    latencies = []
+    errors = 0
+    next_request = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_request:
+            latency, status = await timed_request(client, endpoint, i)
+            latencies.append(latency)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+    }
+
+
+async def benchmark(base_url, args):
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=300,
+        limits=httpx.Limits(max_connections=max(args.concurrency)),
+    ) as client:
+        # Warm-up: load the corpus and capabilities, and give the history
+        # user some responses to list
+        for endpoint in ("properties", "layers"):
+            await timed_request(client, endpoint, 0)
+        for i in range(3):
+            await client.post(
+                "/ask_question/",
+                json=question(i),
+                headers={"Authorization": f"Bearer {token('bench-history')}"},
+            )
+
+        print(
+            f"{'endpoint':<14}{'in flight':>10}{'requests':>10}{'errors':>8}"
+            f"{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        )
+        results = []
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                result = await run_level(client, endpoint, concurrency, args.requests)
+                results.append(result)
+                print(
+                    f"{endpoint:<14}{concurrency:>10}{result['requests']:>10}"
+                    f"{result['errors']:>8}{result['throughput']:>10.1f}"
+                    f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                    f"{result['p99_ms']:>10.1f}"
+                )
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the API against local fake WMS and Mistral servers."
+    )
+    parser.add_argument(
+        "--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS)
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--requests", type=int, default=100, help="Requests per endpoint and level"
+    )
+    parser.add_argument("--wms-latency", type=float, default=0.08)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument(
+        "--database-url", help="Use this database (e.g. a temporary Postgres)"
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base_url, processes = start_services(args, workdir)
+        try:
+            results = asyncio.run(benchmark(base_url, args))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from helpers.cache import LRUCache
+from helpers.lexical import NUMBER_PATTERN, fold
+from helpers.metrics import timed
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 2048))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 7 * 86400))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+# Paraphrases compared per semantic bucket
+SEMANTIC_BUCKET_SIZE = 64
+
+# Words that flip the meaning of a question while barely moving its
+# embedding ("altura máxima" and "altura mínima"), in folded form
+CONTRASTING_WORDS = frozenset(
+    "maximo maxima maximos maximas minimo minima minimos minimas maior maiores "
+    "menor menores superior superiores inferior inferiores acima abaixo "
+    "nao proibido proibida permitido permitida".split()
+)
+
+
+def normalize_question(question):
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = re.sub(r"\s+", " ", question).strip()
+    return question.rstrip("?!. ")
+
+
+def answer_key(municipality, classifications, question):
+    return (
+        municipality,
+        tuple(sorted(set(classifications))),
+        normalize_question(question),
+    )
+
+
+def semantic_bucket(municipality, classifications, question):
+    """
+    Questions are only compared semantically with questions citing the same
+    numbers (articles, heights, areas) and contrasting words, since embeddings
+    barely tell "Artigo 45.º" from "Artigo 46.º".
+    """
+    folded = fold(question)
+    return (
+        municipality,
+        tuple(sorted(set(classifications))),
+        tuple(sorted({int(number) for number in NUMBER_PATTERN.findall(folded)})),
+        tuple(sorted(set(re.findall(r"\w+", folded)) & CONTRASTING_WORDS)),
+    )
+
+
+class AnswerCache:
+    """
+    Two-tier cache of generated answers.
+
+    The exact tier is keyed on municipality, the sorted set of PDM
+    classification strings and the normalized question. The semantic tier
+    keeps the embedding of every answered question, grouped in buckets by
+    semantic_bucket, and returns a cached answer when a new question is
+    similar enough to one already answered in its bucket.
+    """
+
+    def __init__(
+        self,
+        vectorizer=None,
+        maxsize=ANSWER_CACHE_SIZE,
+        ttl=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    ):
+        self.vectorizer = vectorizer
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact = LRUCache(maxsize=maxsize, ttl=ttl)
+        # (question vector, payload) per exact key, so the number of vectors
+        # is bounded like the number of answers
+        self.semantic = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Exact keys of the questions of each bucket
+        self.buckets = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.semantic_hits = 0
+
+    @property
+    def semantic_enabled(self):
+        return self.vectorizer is not None and self.similarity_threshold <= 1.0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    async def _embed_async(self, question):
+        embeddings = await self.vectorizer.get_text_embedding_async(
+            [normalize_question(question)]
+        )
+        return self._unit(embeddings[0])
+
+    def _candidates(self, bucket):
+        """Semantic entries of the bucket that are still cached."""
+        entries = []
+        for key in self.buckets.get(bucket) or []:
+            entry = self.semantic.get(key)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def _best_match(self, entries, vector):
+        similarities = np.stack([entry[0] for entry in entries]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        self.semantic_hits += 1
+        return entries[best][1]
+
+    def _remember(self, key, bucket, vector, payload):
+        self.semantic.set(key, (vector, payload))
+        keys = [k for k in self.buckets.get(bucket) or [] if k != key]
+        keys.append(key)
+        self.buckets.set(bucket, keys[-SEMANTIC_BUCKET_SIZE:])
+
+    @timed("answer_cache")
+    async def get_async(self, municipality, classifications, question):
+        key = answer_key(municipality, classifications, question)
+        payload = self.exact.get(key)
+        if payload is not None or not self.semantic_enabled:
+            return payload
+
+        entries = self._candidates(
+            semantic_bucket(municipality, classifications, question)
+        )
+        if not entries:
+            return None
+        return self._best_match(entries, await self._embed_async(question))
+
+    async def set_async(self, municipality, classifications, question, payload):
+        key = answer_key(municipality, classifications, question)
+        self.exact.set(key, payload)
+
+        if self.semantic_enabled:
+            bucket = semantic_bucket(municipality, classifications, question)
+            self._remember(key, bucket, await self._embed_async(question), payload)
+
+    def invalidate(self, municipality=None):
+        def matches(key):
+            return municipality is None or key[0] == municipality
+
+        self.exact.invalidate(matches)
+        self.semantic.invalidate(matches)
+        self.buckets.invalidate(matches)
+
+    def stats(self):
+        return {**self.exact.stats(), "semantic_hits": self.semantic_hits}
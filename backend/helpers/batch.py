@@ -0,0 +1,78 @@
+import os
+import time
+import uuid
+
+from helpers.cache import LRUCache
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 200))
+BATCH_GENERATION_CONCURRENCY = int(os.getenv("BATCH_GENERATION_CONCURRENCY", 4))
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", 86400))
+
+
+class BatchJob:
+    """
+    Progress and results of a batch of (location, question) items.
+
+    Results are filled in as answers complete, so a poll returns partial
+    results while the job is running.
+    """
+
+    def __init__(self, user_id, location_count, question_count):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "pending"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.items = [
+            {"location": location_index, "question": question_index}
+            for location_index in range(location_count)
+            for question_index in range(question_count)
+        ]
+        self.question_count = question_count
+        self.results = [None] * len(self.items)
+        self.groups = 0
+        self.generated = 0
+
+    def _index(self, location_index, question_index):
+        return location_index * self.question_count + question_index
+
+    def complete(self, location_index, question_index, result):
+        index = self._index(location_index, question_index)
+        self.results[index] = {**self.items[index], **result}
+
+    def fail(self, location_index, question_index, detail):
+        index = self._index(location_index, question_index)
+        self.results[index] = {**self.items[index], "error": detail}
+
+    def finish(self, status="done"):
+        self.status = status
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        completed = [result for result in self.results if result is not None]
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            "completed": len(completed),
+            "failed": sum(1 for result in completed if "error" in result),
+            "groups": self.groups,
+            "generated": self.generated,
+            "results": completed,
+        }
+
+
+class BatchJobStore:
+    """In-process registry of batch jobs, expired BATCH_JOB_TTL after creation."""
+
+    def __init__(self, maxsize=1000, ttl=BATCH_JOB_TTL):
+        self.jobs = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def add(self, job):
+        self.jobs.set(job.id, job)
+
+    def get(self, job_id, user_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
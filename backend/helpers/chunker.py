@@ -1,38 +1,191 @@
-import fitz
+import argparse
+import json
+import os
 import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.config import municipalities
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+
+# Splitting rules for municipalities without a "chunking" entry in their
+# configuration: one chunk per "Artigo" heading, over the whole document
+DEFAULT_CHUNKING = {
+    "start_marker": None,
+    "page_header": None,
+    "article": r"Artigo",
+    "boundary": r"TÍTULO|CAPÍTULO|SECÇÃO|SUBSECÇÃO|Artigo|ANEXOS",
+}
+
+Article = namedtuple("Article", ["title", "page", "text"])
+
+
+class ChunkingRules:
+    """Precompiled rules for splitting one municipality's regulation."""
+
+    def __init__(self, start_marker=None, page_header=None, article="", boundary=""):
+        self.start_marker = start_marker
+        self.page_header = re.compile(page_header) if page_header else None
+        self.article = re.compile(article)
+        self.boundary = re.compile(boundary)
+
+    @classmethod
+    def for_municipality(cls, municipality):
+        params = municipalities.get(municipality, {})
+        return cls(**{**DEFAULT_CHUNKING, **params.get("chunking", {})})
+
+    def clean_page(self, text):
+        if self.page_header is None:
+            return text
+        return self.page_header.sub("", text)
+
+
+# Each worker process opens the document once and extracts the pages it is sent
+_worker_document = None
+
+
+def _open_worker_document(pdf_path):
+    import fitz
+
+    global _worker_document
+    _worker_document = fitz.open(pdf_path)
+
+
+def _extract_page(page_number):
+    return _worker_document[page_number].get_text("text")
 
 
 class PDFChunker:
-    def __init__(self, pdf_path):
+    def __init__(self, pdf_path, municipality="Porto", rules=None):
+        import fitz
+
         self.pdf_path = pdf_path
         self.pdf_document = fitz.open(pdf_path)
+        self.rules = rules or ChunkingRules.for_municipality(municipality)
 
-    def split_pdf_by_articles(self):
-        text = ""
-        for page in self.pdf_document:
-            text += page.get_text("text")  # Options: "text", "html", "xml"
+    def iter_pages(self, workers=PDF_EXTRACT_WORKERS, window=None):
+        """
+        Yield (page_number, text) in order, page numbers starting at 1.
+
+        With more than one worker, pages are extracted by a process pool in
+        windows of a few pages per worker, so only a window is held at once.
+        """
+        page_count = self.pdf_document.page_count
+        if workers <= 1 or page_count < 2:
+            for page in self.pdf_document:
+                yield page.number + 1, page.get_text("text")
+            return
+
+        window = window or workers * 4
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_open_worker_document,
+            initargs=(self.pdf_path,),
+        ) as executor:
+            for start in range(0, page_count, window):
+                numbers = range(start, min(start + window, page_count))
+                for number, text in zip(numbers, executor.map(_extract_page, numbers)):
+                    yield number + 1, text
+
+    def iter_articles(self, workers=PDF_EXTRACT_WORKERS):
+        """
+        Stream the articles of the regulation with the page each starts on.
+
+        An article runs from an article heading to the next structural
+        heading (title, chapter, section, article or annexes). Only the text
+        after the start marker is considered, and page headers are removed
+        before splitting.
+        """
+        rules = self.rules
+        started = rules.start_marker is None
+        buffer = ""
+        # (offset in buffer, page number) of every page start in the buffer
+        page_starts = []
+
+        def page_at(offset):
+            page = page_starts[0][1]
+            for start, number in page_starts:
+                if start > offset:
+                    break
+                page = number
+            return page
+
+        def article(start, end):
+            text = buffer[start:end]
+            return Article(text.split("\n", 1)[0].strip(), page_at(start), text)
 
-        text = text.split(
-            "Republicação do Regulamento do Plano Diretor Municipal do Porto"
-        )[1]
-        # Split the text by the pattern "Artigo" followed by some numbering
-        pattern = r"Artigo[\s\S]*?(?=TÍTULO|CAPÍTULO|SECÇÃO|SUBSECÇÃO|Artigo|ANEXOS)"
-        matches = re.findall(pattern, text)
+        for page_number, text in self.iter_pages(workers):
+            if not started:
+                marker = text.find(rules.start_marker)
+                if marker == -1:
+                    continue
+                started = True
+                text = text[marker + len(rules.start_marker) :]
 
-        clean_matches = []
+            page_starts.append((len(buffer), page_number))
+            buffer += rules.clean_page(text)
 
-        for match in matches:
-            # The regex pattern to match the target text
-            pattern = r"N\.º 20\s+27 de janeiro de 2023\s+Pág\. .*?\s+Diário da República, 2\.\ª série\s+PARTE .*"
+            # Every boundary but the last closes a section; the text after the
+            # last one may continue on the next page
+            boundaries = [m.start() for m in rules.boundary.finditer(buffer)]
+            for start, end in zip(boundaries, boundaries[1:]):
+                if rules.article.match(buffer, start):
+                    yield article(start, end)
 
-            # Remove the matched pattern
-            clean_match = re.sub(pattern, "", match)
-            clean_matches.append(clean_match)
+            if boundaries:
+                cut = boundaries[-1]
+                buffer = buffer[cut:]
+                page_starts = [(0, page_at(cut))] + [
+                    (start - cut, number)
+                    for start, number in page_starts
+                    if start > cut
+                ]
 
-        return clean_matches
+        if buffer and rules.article.match(buffer):
+            yield article(0, len(buffer))
+
+    def split_pdf_by_articles(self):
+        return [article.text for article in self.iter_articles()]
 
     def save_chunks_to_file(self, chunks, output_path):
         with open(output_path, "w") as f:
             for chunk in chunks:
                 f.write(chunk + "\n\n")
         print(f"Chunks saved to {output_path}")
+
+
+def save_article_pages(article_pages, municipality, path="data/article_pages.json"):
+    """Record the page of each article title for the frontend's PDF links."""
+    pages = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            pages = json.load(f)
+    pages[municipality] = article_pages
+    with open(path, "w") as f:
+        json.dump(pages, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split a regulation PDF into one chunk per article."
+    )
+    parser.add_argument("municipality")
+    parser.add_argument("pdf_path")
+    parser.add_argument("output_path", help="Text file with one article per chunk")
+    parser.add_argument(
+        "--article-pages", help="Also update this article_pages.json with the pages"
+    )
+    parser.add_argument("--workers", type=int, default=PDF_EXTRACT_WORKERS)
+    args = parser.parse_args()
+
+    chunker = PDFChunker(args.pdf_path, args.municipality)
+    article_pages = {}
+    with open(args.output_path, "w") as f:
+        for article in chunker.iter_articles(args.workers):
+            f.write(article.text + "\n\n")
+            article_pages.setdefault(article.title, article.page)
+    print(f"{len(article_pages)} articles saved to {args.output_path}")
+
+    if args.article_pages:
+        save_article_pages(article_pages, args.municipality, args.article_pages)
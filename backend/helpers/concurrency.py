@@ -0,0 +1,39 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded pools for the blocking work left on the request path: "io" for
+# capabilities downloads and file/index loading, "cpu" for FAISS searches
+EXECUTOR_WORKERS = {
+    "io": int(os.getenv("IO_EXECUTOR_WORKERS", 16)),
+    "cpu": int(os.getenv("CPU_EXECUTOR_WORKERS", os.cpu_count() or 4)),
+}
+
+_executors = {}
+
+
+def get_executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        executor = _executors[kind] = ThreadPoolExecutor(
+            max_workers=EXECUTOR_WORKERS[kind], thread_name_prefix=kind
+        )
+    return executor
+
+
+async def run_blocking(kind, fn, *args, **kwargs):
+    """Run a blocking call on the bounded executor of the given kind."""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context over, so timing spans reach its request
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(kind), functools.partial(context.run, fn, *args, **kwargs)
+    )
+
+
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown(wait=False)
+    _executors.clear()
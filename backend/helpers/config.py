@@ -0,0 +1,37 @@
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+MUNICIPALITIES_CONFIG_PATH = os.getenv(
+    "MUNICIPALITIES_CONFIG_PATH", "data/municipalities_configs.json"
+)
+
+
+class LazyConfig(Mapping):
+    """Read-only JSON configuration, read from disk on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    with open(self.path) as f:
+                        self._data = json.load(f)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+municipalities = LazyConfig(MUNICIPALITIES_CONFIG_PATH)
@@ -0,0 +1,158 @@
+import functools
+import logging
+import os
+import re
+from collections import namedtuple
+
+from helpers.config import municipalities
+from helpers.metrics import Histogram
+from helpers.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+
+ARTICLE_PATTERN = re.compile(r"^Artigo (\d+)\.?º?", re.MULTILINE)
+# Left over from the PDF layout: Diário da República page headers, line
+# wraps (a trailing space before the newline) and "bem -estar" style breaks
+BOILERPLATE_PATTERNS = [
+    (
+        re.compile(
+            r"N\.º \d+\s+\d+ de \w+ de \d{4}\s+Pág\. \d+\s+"
+            r"Diário da República, \d\.\ª série\s+PARTE .*"
+        ),
+        "",
+    ),
+    (re.compile(r" +\n"), " "),
+    (re.compile(r"(\w) -(\w)"), r"\1-\2"),
+    (re.compile(r"[ \t]{2,}"), " "),
+]
+
+context_tokens = Histogram(
+    "pdm_context_tokens",
+    "Tokens of regulation text packed into each prompt.",
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 32000),
+)
+
+PackedContext = namedtuple("PackedContext", ["text", "articles", "tokens", "dropped"])
+
+
+@functools.lru_cache(maxsize=1)
+def _tokenizer():
+    # The exact Mistral tokenizer is optional; without it tokens are estimated
+    try:
+        from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+
+        return MistralTokenizer.v3().instruct_tokenizer.tokenizer
+    except ImportError:
+        return None
+
+
+def load_tokenizer():
+    """Load the tokenizer ahead of the first prompt; it takes about a second."""
+    _tokenizer()
+
+
+def count_tokens(text):
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, bos=False, eos=False))
+
+
+def token_budget_for(municipality):
+    params = municipalities.get(municipality, {})
+    return int(params.get("context_token_budget", CONTEXT_TOKEN_BUDGET))
+
+
+def clean_text(text):
+    for pattern, replacement in BOILERPLATE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def parse_chunk(chunk):
+    """
+    Split an enriched article chunk into (section, title, number, body).
+
+    Chunks start with the breadcrumb of the section they belong to, followed
+    by the "Artigo N.º" line and the article text.
+    """
+    chunk = chunk.strip()
+    match = ARTICLE_PATTERN.search(chunk)
+    if match is None:
+        return "", "", None, clean_text(chunk)
+    section = chunk[: match.start()].strip()
+    title = match.group(0).strip()
+    return section, title, int(match.group(1)), clean_text(chunk[match.end() :])
+
+
+def _truncate(text, max_tokens):
+    """Cut text at a line boundary so that it fits in max_tokens."""
+    lines = []
+    used = 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line + "\n")
+        if used + line_tokens > max_tokens:
+            break
+        lines.append(line)
+        used += line_tokens
+    return "\n".join(lines)
+
+
+def pack_context(ranked_chunks, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Fit retrieved articles into a token budget.
+
+    Articles are taken by relevance (the order of ranked_chunks, which may
+    hold chunks or (chunk, score) pairs) while they fit; the most relevant
+    one is truncated rather than dropped if it alone exceeds the budget. The
+    chosen articles are then laid out in article number order, with each
+    section breadcrumb written once and the PDF boilerplate removed.
+
+    Returns:
+        PackedContext: text, article titles in prompt order, tokens used,
+        and the number of articles left out.
+    """
+    parsed = []
+    for item in ranked_chunks:
+        chunk = item[0] if isinstance(item, tuple) else item
+        parsed.append(parse_chunk(chunk))
+
+    selected = []
+    used = 0
+    for section, title, number, body in parsed:
+        entry = f"{title}\n{body}" if title else body
+        # Section lines are shared, so count them generously once per article
+        tokens = count_tokens(entry) + count_tokens(section) + 2
+        if used + tokens > token_budget:
+            if selected:
+                continue
+            entry = _truncate(entry, token_budget - count_tokens(section) - 2)
+            tokens = token_budget
+        selected.append(
+            (number if number is not None else float("inf"), section, title, entry)
+        )
+        used += tokens
+
+    selected.sort(key=lambda article: article[0])
+
+    blocks = []
+    previous_section = None
+    for _, section, _, entry in selected:
+        if section and section != previous_section:
+            blocks.append(f"## {section}")
+            previous_section = section
+        blocks.append(entry)
+    text = "\n\n".join(blocks)
+
+    tokens = count_tokens(text)
+    context_tokens.observe(tokens)
+    dropped = len(parsed) - len(selected)
+    logger.debug(
+        f"Packed {len(selected)} articles in {tokens} tokens, {dropped} dropped"
+    )
+
+    return PackedContext(
+        text, [title for _, _, title, _ in selected if title], tokens, dropped
+    )
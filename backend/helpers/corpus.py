@@ -0,0 +1,287 @@
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from helpers.config import municipalities
+from helpers.context import ARTICLE_PATTERN
+from helpers.faiss_index import FAISS_EF_SEARCH, FAISS_NPROBE
+from helpers.lexical import LEXICAL_SEARCH, ArticleResolver, BM25Index
+from helpers.metrics import timed
+from helpers.retriever import RETRIEVAL_MAX_RESULTS, Retriever, fuse_rankings
+
+CORPUS_MAX_LOADED = int(os.getenv("CORPUS_MAX_LOADED", 8))
+DEFAULT_INDEX_PATH = "data/artigos_embeddings.faiss"
+DEFAULT_CHUNKS_PATH = "data/enriched_articles.txt"
+DEFAULT_ARTICLE_PAGES_PATH = "data/article_pages.json"
+CHUNK_SEPARATOR = b"\n\n"
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped view of a chunk file (chunks separated by blank
+    lines). A sidecar .offsets.npy file holds the byte range of every chunk in
+    FAISS id order, so chunk i is decoded on demand without loading the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = self._load_offsets()
+        self._file = open(path, "rb")
+        # An empty file can't be mapped; it holds a single empty chunk
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.path.getsize(path)
+            else b""
+        )
+
+    def _load_offsets(self):
+        offsets_path = f"{self.path}.offsets.npy"
+        if os.path.exists(offsets_path) and os.path.getmtime(
+            offsets_path
+        ) >= os.path.getmtime(self.path):
+            return np.load(offsets_path)
+
+        offsets = build_offsets(self.path)
+        try:
+            np.save(offsets_path, offsets)
+        except OSError:
+            pass
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i]
+        return self._mmap[start:end].decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+
+def build_offsets(path):
+    """Byte (start, end) of every chunk, matching str.split("\\n\\n") order."""
+    if os.path.getsize(path) == 0:
+        return np.zeros((1, 2), dtype=np.int64)
+
+    offsets = []
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        start = 0
+        while True:
+            end = data.find(CHUNK_SEPARATOR, start)
+            if end == -1:
+                offsets.append((start, len(data)))
+                break
+            offsets.append((start, end))
+            start = end + len(CHUNK_SEPARATOR)
+    return np.array(offsets, dtype=np.int64)
+
+
+# Queries answered by each retrieval path, across corpora
+retrieval_counts = {"lexical": 0, "dense": 0, "cited_articles": 0}
+
+
+def collect_retrieval():
+    """Retrieval counters by path, for metrics.register_collector."""
+    return [
+        (
+            "pdm_retrieval_queries_total",
+            "counter",
+            "Retrieval inputs served by each path",
+            [((("path", path),), count) for path, count in retrieval_counts.items()],
+        )
+    ]
+
+
+class Corpus:
+    """
+    Hybrid retrieval over one municipality's regulation.
+
+    Each input is searched in the BM25 index first; only inputs without a
+    confident lexical match are embedded for the dense search, so the
+    embedding call is skipped when every input matches confidently. The
+    lexical and dense rankings are merged by reciprocal rank fusion, and
+    articles cited in the question ("Artigo 45.º") are put first.
+    """
+
+    def __init__(self, municipality, retriever, chunks, lexical=None, articles=None):
+        self.municipality = municipality
+        self.retriever = retriever
+        self.chunks = chunks
+        self.lexical = lexical
+        self.articles = articles
+
+    def _search_lexical(self, inputs, k):
+        """BM25 ranking of every input, and the inputs that need a dense search."""
+        if self.lexical is None:
+            return [], list(inputs)
+
+        rankings = []
+        dense_inputs = []
+        for text in inputs:
+            hits = self.lexical.search(text, k)
+            rankings.append([hit.chunk_id for hit in hits])
+            if hits and hits[0].confident:
+                retrieval_counts["lexical"] += 1
+            else:
+                dense_inputs.append(text)
+        retrieval_counts["dense"] += len(dense_inputs)
+        return rankings, dense_inputs
+
+    def _merge(self, question, lexical_rankings, dense_hits, max_results):
+        rankings = [[chunk_id for chunk_id, _ in dense_hits]] if dense_hits else []
+        if lexical_rankings:
+            lexical = fuse_rankings(lexical_rankings, max_results=None)
+            rankings.append([chunk_id for chunk_id, _ in lexical])
+        ranked = fuse_rankings(rankings, max_results=max_results)
+
+        cited = self.articles.resolve(question) if self.articles and question else []
+        retrieval_counts["cited_articles"] += len(cited)
+        ranked = [(chunk_id, 1.0) for chunk_id in cited] + [
+            (chunk_id, score) for chunk_id, score in ranked if chunk_id not in cited
+        ]
+        return [(self.chunks[chunk_id], score) for chunk_id, score in ranked]
+
+    async def retrieve_async(
+        self, inputs, question=None, k=5, max_results=RETRIEVAL_MAX_RESULTS, **kwargs
+    ):
+        """Return [(chunk, score)] for the inputs, most relevant first."""
+        lexical_rankings, dense_inputs = self._search_lexical(inputs, k)
+        dense_hits = await self.retriever.search_async(
+            dense_inputs, k, max_results=None, **kwargs
+        )
+        return self._merge(question, lexical_rankings, dense_hits, max_results)
+
+
+def article_number(chunk):
+    match = ARTICLE_PATTERN.search(chunk)
+    return int(match.group(1)) if match else None
+
+
+def load_lexical(chunks):
+    """
+    BM25 index and article number of every chunk of a ChunkStore.
+
+    Both are kept in a .lexical.npz sidecar next to the chunk file, like the
+    offsets, so loading a corpus doesn't read its texts back into memory.
+    """
+    lexical_path = f"{chunks.path}.lexical.npz"
+    if os.path.exists(lexical_path) and os.path.getmtime(
+        lexical_path
+    ) >= os.path.getmtime(chunks.path):
+        with np.load(lexical_path) as arrays:
+            numbers = arrays["articles"]
+            return BM25Index.from_arrays(arrays), [
+                int(n) if n >= 0 else None for n in numbers
+            ]
+
+    numbers = []
+
+    def texts():
+        for text in chunks:
+            numbers.append(article_number(text))
+            yield text
+
+    index = BM25Index(texts())
+    try:
+        tmp_path = f"{lexical_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                articles=np.array(
+                    [-1 if n is None else n for n in numbers], dtype=np.int32
+                ),
+                **index.arrays(),
+            )
+        os.replace(tmp_path, lexical_path)
+    except OSError:
+        pass
+    return index, numbers
+
+
+def load_article_pages(params, municipality):
+    path = params.get("article_pages_path", DEFAULT_ARTICLE_PAGES_PATH)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get(municipality, {})
+
+
+class CorpusRegistry:
+    """
+    Lazily loads one retrieval corpus (FAISS index + chunk texts) per
+    municipality, memory-mapped, and evicts the least recently used ones.
+    """
+
+    def __init__(self, vectorizer, max_loaded=CORPUS_MAX_LOADED):
+        self.vectorizer = vectorizer
+        self.max_loaded = max_loaded
+        self._corpora = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def _cached(self, municipality):
+        with self._lock:
+            corpus = self._corpora.get(municipality)
+            if corpus is not None:
+                self._corpora.move_to_end(municipality)
+            return corpus
+
+    def _load_lock(self, municipality):
+        with self._lock:
+            return self._load_locks.setdefault(municipality, threading.Lock())
+
+    def get(self, municipality):
+        corpus = self._cached(municipality)
+        if corpus is not None:
+            return corpus
+
+        # Only one thread per municipality loads it; lookups of the corpora
+        # already loaded don't wait for it
+        with self._load_lock(municipality):
+            corpus = self._cached(municipality)
+            if corpus is not None:
+                return corpus
+
+            corpus = self._load(municipality)
+            with self._lock:
+                self._corpora[municipality] = corpus
+                while len(self._corpora) > self.max_loaded:
+                    # Requests still holding the evicted corpus keep it alive;
+                    # the mappings are released when the last reference goes
+                    self._corpora.popitem(last=False)
+            return corpus
+
+    @timed("corpus_load")
+    def _load(self, municipality):
+        params = municipalities[municipality]
+        retriever = Retriever(
+            params.get("index_path", DEFAULT_INDEX_PATH),
+            self.vectorizer,
+            mmap=True,
+            nprobe=params.get("faiss_nprobe", FAISS_NPROBE),
+            ef_search=params.get("faiss_ef_search", FAISS_EF_SEARCH),
+        )
+        chunks = ChunkStore(params.get("chunks_path", DEFAULT_CHUNKS_PATH))
+        lexical = articles = None
+        if LEXICAL_SEARCH:
+            lexical, chunk_articles = load_lexical(chunks)
+            articles = ArticleResolver(
+                load_article_pages(params, municipality), chunk_articles
+            )
+        return Corpus(municipality, retriever, chunks, lexical, articles)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._corpora)
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from helpers.cache import LRUCache
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+EMBEDDING_MEMORY_CACHE_SIZE = int(os.getenv("EMBEDDING_MEMORY_CACHE_SIZE", 4096))
+
+
+def embedding_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed embedding cache: an in-memory LRU tier in front of an
+    optional SQLite file holding float32 vectors keyed by hash(model, text).
+    """
+
+    def __init__(
+        self, path=EMBEDDING_CACHE_PATH, memory_size=EMBEDDING_MEMORY_CACHE_SIZE
+    ):
+        self.path = path
+        self.memory = LRUCache(maxsize=memory_size)
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def persistent(self):
+        return bool(self.path)
+
+    @property
+    def _connection(self):
+        # Opened on first use, so importing the app creates no file; callers
+        # hold self._lock
+        if self._db is None and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            connection.commit()
+            self._db = connection
+        return self._db
+
+    def get_many(self, keys, disk=True):
+        """
+        Return {key: vector} for the keys that are cached in either tier, or
+        only in memory when disk is False, which never blocks on SQLite.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+
+        if disk and missing and self.persistent:
+            with self._lock:
+                rows = []
+                # Stay well below SQLite's bound parameter limit
+                for i in range(0, len(missing), 500):
+                    batch = missing[i : i + 500]
+                    rows.extend(
+                        self._connection.execute(
+                            "SELECT key, vector FROM embeddings WHERE key IN "
+                            f"({','.join('?' * len(batch))})",
+                            batch,
+                        ).fetchall()
+                    )
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self.memory.set(key, vector)
+                found[key] = vector
+
+        return found
+
+    def put_many(self, model, items):
+        """Store an iterable of (key, vector) pairs in both tiers."""
+        rows = []
+        for key, vector in items:
+            vector = np.asarray(vector, dtype=np.float32)
+            self.memory.set(key, vector)
+            rows.append((key, model, vector.tobytes()))
+
+        if rows and self.persistent:
+            with self._lock:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) "
+                    "VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._connection.commit()
+
+    def stats(self):
+        return self.memory.stats()
@@ -0,0 +1,107 @@
+import math
+import os
+
+import numpy as np
+
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Inverted lists of the IVF types; 0 picks about 4 * sqrt(vectors)
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", 0))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", 32))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", 64))
+# Search-time accuracy/speed trade-offs, read when an index is loaded
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 8))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 64))
+
+# The FAISS training heuristics want this many points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+INDEX_TYPES = (
+    # Exact search over float32 vectors
+    "flat",
+    # Scalar quantization: float16 halves the size, SQ8 quarters it
+    "fp16",
+    "sq8",
+    # Inverted file: only the nprobe nearest lists are scanned
+    "ivf_flat",
+    # Graph search, larger than flat but fastest at high recall
+    "hnsw",
+    # Inverted file over product-quantized codes, the smallest
+    "ivf_pq",
+)
+
+
+def default_nlist(count):
+    nlist = FAISS_NLIST or int(4 * math.sqrt(count))
+    return max(1, min(nlist, count // MIN_POINTS_PER_CENTROID))
+
+
+def factory_string(index_type, count, dimension):
+    """The faiss.index_factory description of an index type for the vectors."""
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "fp16":
+        return "SQfp16"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "ivf_flat":
+        return f"IVF{default_nlist(count)},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{FAISS_HNSW_M}"
+    if index_type == "ivf_pq":
+        # The sub-quantizers must divide the dimension, and each of their
+        # 2**nbits centroids needs MIN_POINTS_PER_CENTROID training points
+        m = math.gcd(FAISS_PQ_M, dimension)
+        centroids = max(count // MIN_POINTS_PER_CENTROID, 2)
+        nbits = max(1, min(8, int(math.log2(centroids))))
+        return f"IVF{default_nlist(count)},PQ{m}x{nbits}"
+    raise ValueError(
+        f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}"
+    )
+
+
+def build_index(vectors, index_type=FAISS_INDEX_TYPE):
+    """Train (if needed) and fill an L2 index of the given type."""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    index = faiss.index_factory(
+        dimension, factory_string(index_type, count, dimension), faiss.METRIC_L2
+    )
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def configure_search(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """Apply the search-time parameters that the index type has."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def read_index(path, mmap=False):
+    """
+    Read an index, memory-mapped when requested.
+
+    IO_FLAG_MMAP_IFC maps the vectors or codes of every index type, so they
+    are paged in by the OS and shared between workers. Faiss versions
+    without it fall back to IO_FLAG_MMAP, which only maps the inverted
+    lists of the IVF types, and a file that can't be mapped is read into
+    memory.
+    """
+    import faiss
+
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
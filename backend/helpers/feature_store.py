@@ -0,0 +1,270 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+FEATURE_SNAPSHOT_DIR = os.getenv("WMS_FEATURE_SNAPSHOT_DIR", "data/snapshots")
+FEATURE_SNAPSHOT_MAX_AGE = float(os.getenv("WMS_FEATURE_SNAPSHOT_MAX_AGE", 30 * 86400))
+FEATURE_INDEX_CELL_SIZE = 0.002
+WFS_PAGE_SIZE = 5000
+COORDINATE_PRECISION = 7
+
+
+def snapshot_path(municipality, params):
+    return params.get(
+        "feature_snapshot_path",
+        os.path.join(FEATURE_SNAPSHOT_DIR, f"{municipality}_features.json.gz"),
+    )
+
+
+def capabilities_fingerprint(wms):
+    xml = wms.getServiceXML() or b""
+    return hashlib.sha256(xml).hexdigest()
+
+
+def _round_coordinates(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [round(value, COORDINATE_PRECISION) for value in coordinates[:2]]
+    return [_round_coordinates(part) for part in coordinates]
+
+
+def _polygons(geometry):
+    """Return the geometry as a list of polygons (lists of rings), or []."""
+    if not geometry:
+        return []
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _bounds(polygons):
+    lons = [point[0] for polygon in polygons for ring in polygon for point in ring]
+    lats = [point[1] for polygon in polygons for ring in polygon for point in ring]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def _point_in_polygon(lon, lat, polygon):
+    # Even-odd ray casting over every ring, so holes are handled too
+    inside = False
+    for ring in polygon:
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            x_i, y_i = ring[i][0], ring[i][1]
+            x_j, y_j = ring[j][0], ring[j][1]
+            if (y_i > lat) != (y_j > lat) and lon < (x_j - x_i) * (lat - y_i) / (
+                y_j - y_i
+            ) + x_i:
+                inside = not inside
+            j = i
+    return inside
+
+
+def harvest_features(wms_service, output_path=None, layers=None):
+    """
+    Download the polygon features of every layer through WFS and write them
+    to a compact gzipped snapshot that LocalFeatureStore can query.
+
+    Layers the WFS doesn't serve (rasters, layer groups) are skipped and keep
+    being answered by the live WMS.
+    """
+    params = wms_service.municipality_params
+    wfs_url = params.get("wfs_url", wms_service.wms_url.rsplit("/wms", 1)[0] + "/wfs")
+    output_path = output_path or snapshot_path(wms_service.municipality, params)
+
+    snapshot = {
+        "municipality": wms_service.municipality,
+        "harvested_at": time.time(),
+        "capabilities_fingerprint": capabilities_fingerprint(wms_service.wms),
+        "layers": {},
+    }
+
+    for layer_name in layers or list(wms_service.wms.contents):
+        features = []
+        non_polygons = 0
+        start_index = 0
+        try:
+            while True:
+                response = requests.get(
+                    wfs_url,
+                    params={
+                        "service": "WFS",
+                        "version": "1.1.0",
+                        "request": "GetFeature",
+                        "typeName": layer_name,
+                        "outputFormat": "application/json",
+                        "srsName": "EPSG:4326",
+                        "maxFeatures": WFS_PAGE_SIZE,
+                        "startIndex": start_index,
+                    },
+                    timeout=120,
+                )
+                response.raise_for_status()
+                page = response.json().get("features", [])
+                for feature in page:
+                    polygons = _polygons(feature.get("geometry"))
+                    if not polygons:
+                        non_polygons += 1
+                        continue
+                    features.append(
+                        {
+                            "properties": feature["properties"],
+                            "polygons": _round_coordinates(polygons),
+                        }
+                    )
+                if len(page) < WFS_PAGE_SIZE:
+                    break
+                start_index += WFS_PAGE_SIZE
+        except Exception:
+            logger.warning(f"Skipping {layer_name}: WFS harvest failed", exc_info=True)
+            continue
+
+        # Point and line layers depend on the WMS pixel tolerance, keep them remote
+        if non_polygons:
+            logger.info(f"Skipping {layer_name}: it has non-polygon features")
+            continue
+
+        snapshot["layers"][layer_name] = features
+        logger.info(f"Harvested {len(features)} features from {layer_name}")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+
+    return output_path
+
+
+class LocalFeatureStore:
+    """
+    In-process point-in-polygon lookups over a harvested feature snapshot.
+
+    Features are bucketed on a uniform grid by bounding box, so a lookup only
+    runs the ray casting test for the few polygons around the point.
+    """
+
+    def __init__(self, path, cell_size=FEATURE_INDEX_CELL_SIZE):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+
+        self.path = path
+        self.cell_size = cell_size
+        self.harvested_at = snapshot["harvested_at"]
+        self.capabilities_fingerprint = snapshot["capabilities_fingerprint"]
+        self.layers = snapshot["layers"]
+        self._checked_wms = None
+        self._fresh = False
+
+        self.cells = {}
+        for layer_name, features in self.layers.items():
+            for feature in features:
+                min_lon, min_lat, max_lon, max_lat = _bounds(feature["polygons"])
+                feature["bounds"] = (min_lon, min_lat, max_lon, max_lat)
+                for x in range(self._cell(min_lon), self._cell(max_lon) + 1):
+                    for y in range(self._cell(min_lat), self._cell(max_lat) + 1):
+                        self.cells.setdefault((x, y), []).append((layer_name, feature))
+
+    def _cell(self, value):
+        return int(value // self.cell_size)
+
+    def checked(self, wms):
+        """Whether these live capabilities were already compared with the snapshot."""
+        return wms is self._checked_wms
+
+    def check(self, wms, fingerprint):
+        """Compare the fingerprint of the live capabilities with the snapshot's."""
+        self._fresh = fingerprint == self.capabilities_fingerprint
+        self._checked_wms = wms
+        if not self._fresh:
+            logger.warning(
+                f"Feature snapshot {self.path} no longer matches the live service"
+            )
+
+    def is_fresh(self, wms, max_age=FEATURE_SNAPSHOT_MAX_AGE):
+        """The snapshot is usable while it is recent and the live capabilities are unchanged."""
+        if time.time() - self.harvested_at > max_age:
+            return False
+        # Fingerprint each capabilities document once, not on every lookup
+        if not self.checked(wms):
+            self.check(wms, capabilities_fingerprint(wms))
+        return self._fresh
+
+    def query(self, lon, lat, layer_names):
+        """Return {layer_name: [properties]} for the features containing the point."""
+        results = {name: [] for name in layer_names if name in self.layers}
+        for layer_name, feature in self.cells.get(
+            (self._cell(lon), self._cell(lat)), []
+        ):
+            if layer_name not in results:
+                continue
+            min_lon, min_lat, max_lon, max_lat = feature["bounds"]
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            if any(_point_in_polygon(lon, lat, p) for p in feature["polygons"]):
+                results[layer_name].append(dict(feature["properties"]))
+        return results
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_load_locks = {}
+
+
+def _load_lock(municipality):
+    with _stores_lock:
+        return _load_locks.setdefault(municipality, threading.Lock())
+
+
+def loaded_feature_store(municipality, params):
+    """The municipality's snapshot if it is already loaded, without loading it."""
+    store = _stores.get(municipality)
+    if store is not None and store.path == snapshot_path(municipality, params):
+        return store
+    return None
+
+
+def get_feature_store(municipality, params):
+    """Load (once) and return the municipality's snapshot, or None if there is none."""
+    store = loaded_feature_store(municipality, params)
+    if store is not None:
+        return store
+
+    # Only the municipality being loaded waits; the others keep being served
+    with _load_lock(municipality):
+        store = loaded_feature_store(municipality, params)
+        if store is not None:
+            return store
+        path = snapshot_path(municipality, params)
+        if not os.path.exists(path):
+            return None
+        store = LocalFeatureStore(path)
+        with _stores_lock:
+            _stores[municipality] = store
+        return store
+
+
+if __name__ == "__main__":
+    from helpers.wms import WMService
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Harvest the PDM features of a municipality into a local snapshot."
+    )
+    parser.add_argument("municipality")
+    parser.add_argument("--output", help="Snapshot path (defaults to the config)")
+    parser.add_argument("--layer", action="append", help="Only harvest this layer")
+    args = parser.parse_args()
+
+    path = harvest_features(WMService(args.municipality), args.output, args.layer)
+    print(f"Features saved to {path}")
@@ -1,5 +1,13 @@
+import os
+
 from mistralai import Mistral
 
+from helpers.metrics import span, timed
+from helpers.singleflight import SingleFlight
+
+# Identical prompts generated at the same time share one chat completion
+generation_flights = SingleFlight("generate")
+
 
 class Generator:
     def __init__(
@@ -8,7 +16,7 @@ class Generator:
         model="mistral-large-latest",
     ):
         self.api_key = api_key
-        self.client = Mistral(api_key=api_key)
+        self._client = None
         self.model = model
 
         self.system_prompt = """
@@ -26,7 +34,23 @@ class Generator:
         You answer only in European Portuguese (PT-PT).
         """
 
+    @property
+    def client(self):
+        # Built on first use, so importing the app makes no API client
+        if self._client is None:
+            self._client = Mistral(
+                api_key=self.api_key, server_url=os.getenv("MISTRAL_SERVER_URL")
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
     def generate_prompt(self, layers_formatted, all_relevant_chunks, question):
+        # Packed context arrives as text; a list of chunks is joined as is
+        if not isinstance(all_relevant_chunks, str):
+            all_relevant_chunks = "\n\n".join(all_relevant_chunks)
         return f"""
                 In the Plano Director Municipal, the location is classified as:
 
@@ -44,15 +68,51 @@ class Generator:
                 Answer:
                 """
 
-    def generate(self, prompt):
-        messages = [
+    def get_messages(self, prompt):
+        return [
             {
                 "role": "system",
                 "content": self.system_prompt,
             },
             {"role": "user", "content": prompt},
         ]
+
+    @timed("generate")
+    def generate(self, prompt):
+        return generation_flights.do((self.model, prompt), self._complete, prompt)
+
+    @timed("generate")
+    async def generate_async(self, prompt):
+        return await generation_flights.do_async(
+            (self.model, prompt), self._complete_async, prompt
+        )
+
+    def _complete(self, prompt):
+        messages = self.get_messages(prompt)
         chat_response = self.client.chat.complete(
             model=self.model, messages=messages, temperature=0
         )
         return chat_response.choices[0].message.content
+
+    async def _complete_async(self, prompt):
+        messages = self.get_messages(prompt)
+        chat_response = await self.client.chat.complete_async(
+            model=self.model, messages=messages, temperature=0
+        )
+        return chat_response.choices[0].message.content
+
+    async def generate_stream(self, prompt):
+        """Yield the answer text as it arrives from the Mistral chat stream."""
+        messages = self.get_messages(prompt)
+        with span("generate"):
+            stream = await self.client.chat.stream_async(
+                model=self.model, messages=messages, temperature=0
+            )
+            # Leaving the context closes the upstream stream, also on cancellation
+            async with stream:
+                async for event in stream:
+                    content = event.data.choices[0].delta.content
+                    if isinstance(content, list):
+                        content = "".join(getattr(part, "text", "") for part in content)
+                    if content:
+                        yield content
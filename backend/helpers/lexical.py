@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+import numpy as np
+
+LEXICAL_SEARCH = os.getenv("LEXICAL_SEARCH", "true").lower() not in ("0", "false")
+# Share of a query's term weight the best article must contain, and how far it
+# must lead the runner-up, for the query to be answered without embeddings
+LEXICAL_CONFIDENCE = float(os.getenv("LEXICAL_CONFIDENCE", 0.9))
+LEXICAL_MARGIN = float(os.getenv("LEXICAL_MARGIN", 1.1))
+# Shorter queries match too many articles by chance ("Espaço Central") and
+# always go to the dense search
+LEXICAL_MIN_TERMS = int(os.getenv("LEXICAL_MIN_TERMS", 3))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    "a ao aos as com da das de do dos e em na nas no nos o os ou para pela pelas "
+    "pelo pelos por que se sem um uma".split()
+)
+
+# "Artigo 45.º", "artigos 12.º e 13.º", "art. 7", "arts. 3.º, 4.º", "Art.º 45.º"
+CITATION_PATTERN = re.compile(
+    r"\bart(?:igo)?s?\.?º?\s*((?:\d+\.?\s*º?(?:\s*(?:,|e)\s*)?)+)", re.IGNORECASE
+)
+NUMBER_PATTERN = re.compile(r"\d+")
+
+LexicalHit = namedtuple("LexicalHit", ["chunk_id", "score", "confident"])
+
+
+def fold(text):
+    """Casefold and strip accents, so "Espaços" matches "espacos"."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [
+        token
+        for token in re.findall(r"\w+", fold(text))
+        if len(token) > 1 and token not in STOPWORDS and not token.isdigit()
+    ]
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of a corpus, scored with Okapi BM25.
+    Chunk ids are the chunks' positions, as in the FAISS index.
+
+    Postings are kept in flat arrays (CSR layout: the postings of term i are
+    chunk_ids[offsets[i]:offsets[i + 1]]), which arrays() and from_arrays()
+    save and restore, so a corpus needs its texts only to build the index.
+    """
+
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        """Build the index from an iterable of chunk texts, read once."""
+        postings = {}
+        lengths = []
+        for chunk_id, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((chunk_id, count))
+
+        terms = sorted(postings)
+        entries = [entry for term in terms for entry in postings[term]]
+        self._set_arrays(
+            terms=terms,
+            offsets=np.cumsum([0] + [len(postings[term]) for term in terms]),
+            chunk_ids=[chunk_id for chunk_id, _ in entries],
+            counts=[count for _, count in entries],
+            lengths=lengths,
+            k1=k1,
+            b=b,
+        )
+
+    def _set_arrays(self, terms, offsets, chunk_ids, counts, lengths, k1, b):
+        self.k1 = float(k1)
+        self.b = float(b)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.float32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.size = len(self.lengths)
+
+        average_length = float(self.lengths.mean()) if self.size else 0.0
+        # Per-chunk length normalisation of the term frequency
+        self.norms = self.k1 * (
+            1 - self.b + self.b * self.lengths / (average_length or 1.0)
+        )
+        document_frequency = np.diff(self.offsets)
+        self.idf = np.log(
+            1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5)
+        )
+
+    def arrays(self):
+        """The index as numpy arrays, for np.savez."""
+        return {
+            "terms": np.array(sorted(self.terms, key=self.terms.get), dtype=str),
+            "offsets": self.offsets,
+            "chunk_ids": self.chunk_ids,
+            "counts": self.counts,
+            "lengths": self.lengths,
+            "parameters": np.array([self.k1, self.b]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        k1, b = arrays["parameters"]
+        index._set_arrays(
+            terms=arrays["terms"].tolist(),
+            offsets=arrays["offsets"],
+            chunk_ids=arrays["chunk_ids"],
+            counts=arrays["counts"],
+            lengths=arrays["lengths"],
+            k1=k1,
+            b=b,
+        )
+        return index
+
+    def _postings(self, term):
+        i = self.terms[term]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.chunk_ids[start:end], self.counts[start:end], self.idf[i]
+
+    def search(self, query, k=5):
+        """
+        Return up to k LexicalHit for the query, best first.
+
+        The top hit is confident when the query has at least
+        LEXICAL_MIN_TERMS terms, and the hit contains at least
+        LEXICAL_CONFIDENCE of their IDF weight and scores LEXICAL_MARGIN
+        times the next.
+        """
+        terms = set(tokenize(query))
+        # Terms the corpus lacks weigh as much as a term seen in no chunk
+        missing_idf = math.log(1 + (self.size + 0.5) / 0.5)
+        query_weight = sum(
+            self.idf[self.terms[term]] if term in self.terms else missing_idf
+            for term in terms
+        )
+
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched_weight = np.zeros(self.size, dtype=np.float32)
+        for term in terms & self.terms.keys():
+            ids, counts, idf = self._postings(term)
+            scores[ids] += idf * counts * (self.k1 + 1) / (counts + self.norms[ids])
+            matched_weight[ids] += idf
+
+        top = np.argsort(-scores)[:k]
+        top = top[scores[top] > 0]
+        if not len(top):
+            return []
+
+        coverage = matched_weight[top[0]] / query_weight
+        runner_up = scores[top[1]] if len(top) > 1 else 0.0
+        confident = bool(
+            len(terms) >= LEXICAL_MIN_TERMS
+            and coverage >= LEXICAL_CONFIDENCE
+            and scores[top[0]] >= LEXICAL_MARGIN * runner_up
+        )
+        return [
+            LexicalHit(int(chunk_id), float(scores[chunk_id]), confident and i == 0)
+            for i, chunk_id in enumerate(top)
+        ]
+
+
+def cited_articles(text):
+    """Article numbers cited in the text, in order of appearance."""
+    numbers = []
+    for match in CITATION_PATTERN.finditer(text or ""):
+        for number in NUMBER_PATTERN.findall(match.group(1)):
+            if int(number) not in numbers:
+                numbers.append(int(number))
+    return numbers
+
+
+class ArticleResolver:
+    """
+    Resolve "Artigo N.º" citations to the chunks holding those articles.
+
+    Only articles listed for the municipality in article_pages.json are
+    resolved; the chunk of each is the one whose heading is that article.
+    """
+
+    def __init__(self, article_pages, chunk_articles):
+        """
+        Args:
+            article_pages: {"Artigo N.º": page} of the municipality.
+            chunk_articles: Article number of every chunk (None if it has none).
+        """
+        known = {
+            int(NUMBER_PATTERN.search(title).group())
+            for title in article_pages
+            if NUMBER_PATTERN.search(title)
+        }
+        self.chunk_ids = {}
+        for chunk_id, number in enumerate(chunk_articles):
+            if number in known:
+                self.chunk_ids.setdefault(number, chunk_id)
+
+    def resolve(self, text):
+        return [
+            self.chunk_ids[number]
+            for number in cited_articles(text)
+            if number in self.chunk_ids
+        ]
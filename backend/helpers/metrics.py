@@ -0,0 +1,218 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+# Upper bounds in seconds, from cache hits to full LLM generations
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+# Every histogram created, in creation order, for render()
+_histograms = []
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _histograms.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, the +Inf count and the sum
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {key: (list(s[0]), s[1], s[2]) for key, s in self._series.items()}
+        for key, (counts, count, total) in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + [("le", bound)])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(labels + [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        return lines
+
+
+stage_duration = Histogram(
+    "pdm_stage_duration_seconds",
+    "Time spent in each stage of answering a request.",
+    labelnames=("stage",),
+)
+request_duration = Histogram(
+    "pdm_request_duration_seconds",
+    "Time to respond to an HTTP request, up to the end of the response body.",
+    labelnames=("method", "route", "status"),
+)
+
+# stats() entries that only ever grow, exposed as counters
+COUNTER_KEYS = {"hits", "misses", "evictions", "semantic_hits", "written", "failed"}
+
+# Functions returning [(name, type, documentation, [(labels, value)])] that
+# are called on every scrape, for counters kept by the caches themselves
+_collectors = []
+
+# Spans recorded while handling the current request, for Server-Timing
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def stats_collector(name, documentation, stats, labels=()):
+    """Expose the numeric entries of a stats() dict as pdm_<name>_<key>."""
+
+    def collect():
+        metrics = []
+        for key, value in stats().items():
+            if not isinstance(value, (int, float)):
+                continue
+            if key in COUNTER_KEYS:
+                metric = (f"pdm_{name}_{key}_total", "counter")
+            else:
+                metric = (f"pdm_{name}_{key}", "gauge")
+            metrics.append((*metric, f"{documentation} ({key})", [(labels, value)]))
+        return metrics
+
+    return collect
+
+
+def start_request():
+    """Start collecting the spans of a request; returns the list they go to."""
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+
+class span:
+    """
+    Time a pipeline stage, as a sync or async context manager:
+
+        with span("search"):
+            ...
+
+    The duration goes to the stage histogram and to the Server-Timing header
+    of the request being handled, if any.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        stage_duration.observe(duration, stage=self.stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.stage, duration))
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+def timed(stage):
+    """Decorator timing every call of a function or coroutine as a span."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(spans, total=None):
+    """Server-Timing header value, summing repeated stages."""
+    durations = {}
+    for stage, duration in spans:
+        durations[stage] = durations.get(stage, 0.0) + duration
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(
+        f"{stage};dur={duration * 1000:.1f}" for stage, duration in durations.items()
+    )
+
+
+def render():
+    lines = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+    for collector in _collectors:
+        for name, kind, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from sqlalchemy import case, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from helpers.metrics import timed
+from models import UserRequestCount
+
+
+def month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _insert(db):
+    if db.bind.dialect.name == "sqlite":
+        return sqlite_insert(UserRequestCount)
+    return postgresql_insert(UserRequestCount)
+
+
+@timed("db_quota")
+async def reserve_question(db, user_id):
+    """
+    Atomically take one question from the user's monthly quota.
+
+    A single upsert creates the user's counter, resets it when the last reset
+    happened before the current month, or increments it while it is below the
+    limit. The conflicting row is locked for the duration of the statement,
+    so concurrent requests cannot both take the last slot.
+
+    Returns:
+        bool: False if the user has no questions left this month.
+    """
+    now = datetime.utcnow()
+    new_month = UserRequestCount.last_reset < month_start(now)
+
+    insert = _insert(db)
+    statement = (
+        insert.values(user_id=user_id, questions_asked=1, last_reset=now)
+        .on_conflict_do_update(
+            index_elements=[UserRequestCount.user_id],
+            set_={
+                "questions_asked": case(
+                    (new_month, 1), else_=UserRequestCount.questions_asked + 1
+                ),
+                "last_reset": case((new_month, now), else_=UserRequestCount.last_reset),
+            },
+            where=new_month
+            | (UserRequestCount.questions_asked < UserRequestCount.limit),
+        )
+        .returning(UserRequestCount.questions_asked)
+    )
+
+    reserved = (await db.execute(statement)).first() is not None
+    await db.commit()
+    return reserved
+
+
+async def refund_question(db, user_id):
+    """Give back a question reserved for an answer that was never delivered."""
+    await db.execute(
+        update(UserRequestCount)
+        .where(
+            UserRequestCount.user_id == user_id,
+            UserRequestCount.questions_asked > 0,
+        )
+        .values(questions_asked=UserRequestCount.questions_asked - 1)
+    )
+    await db.commit()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy import insert
+
+from helpers.metrics import timed
+from models import Response
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_WRITE_MODE = os.getenv("RESPONSE_WRITE_MODE", "write_behind")
+RESPONSE_QUEUE_SIZE = int(os.getenv("RESPONSE_QUEUE_SIZE", 1000))
+RESPONSE_BATCH_SIZE = int(os.getenv("RESPONSE_BATCH_SIZE", 100))
+RESPONSE_FLUSH_INTERVAL = float(os.getenv("RESPONSE_FLUSH_INTERVAL", 0.5))
+
+
+class ResponseWriter:
+    """
+    Write-behind persistence of Response rows.
+
+    Rows are queued and a background task inserts them in multi-row batches
+    of up to batch_size, at most flush_interval seconds after the first one
+    arrives. The queue is bounded: when it is full, or in "sync" mode, or
+    before start(), a row is written immediately by the caller instead.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        mode=RESPONSE_WRITE_MODE,
+        maxsize=RESPONSE_QUEUE_SIZE,
+        batch_size=RESPONSE_BATCH_SIZE,
+        flush_interval=RESPONSE_FLUSH_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.mode = mode
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._task = None
+        self.written = 0
+        self.sync_writes = 0
+        self.failed = 0
+
+    async def start(self):
+        if self.mode == "sync":
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush every queued row, then stop the background task."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+
+    async def submit(self, row):
+        """Persist a dict of Response column values."""
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(row)
+                return
+            except asyncio.QueueFull:
+                logger.warning("Response queue is full, writing synchronously")
+
+        self.sync_writes += 1
+        await self._write([row])
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write(batch)
+            except Exception:
+                self.failed += len(batch)
+                logger.exception(f"Failed to write {len(batch)} responses")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @timed("db_write")
+    async def _write(self, rows):
+        async with self.session_factory() as db:
+            await db.execute(insert(Response).values(rows))
+            await db.commit()
+        self.written += len(rows)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "sync_writes": self.sync_writes,
+            "failed": self.failed,
+        }
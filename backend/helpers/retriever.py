@@ -1,18 +1,94 @@
-import faiss
 import numpy as np
+import os
+from helpers.concurrency import run_blocking
+from helpers.faiss_index import (
+    FAISS_EF_SEARCH,
+    FAISS_NPROBE,
+    configure_search,
+    read_index,
+)
+from helpers.metrics import span
+
+RETRIEVAL_MAX_RESULTS = int(os.getenv("RETRIEVAL_MAX_RESULTS", 10))
+RRF_K = 60
+
+
+def fuse_results(D, I, fusion="rrf", max_results=RETRIEVAL_MAX_RESULTS, rrf_k=RRF_K):
+    """
+    Merge the per-query hit lists of a batched FAISS search into one ranking.
+
+    "rrf" sums reciprocal ranks across queries, which rewards chunks that
+    several classifications agree on. "max" keeps each chunk's best
+    similarity, 1 / (1 + L2 distance). Returns [(chunk_id, score)] sorted by
+    descending score, de-duplicated and capped at max_results.
+    """
+    scores = {}
+    for distances, ids in zip(D, I):
+        for rank, (distance, chunk_id) in enumerate(zip(distances, ids)):
+            if chunk_id < 0:
+                continue
+            chunk_id = int(chunk_id)
+            if fusion == "rrf":
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            elif fusion == "max":
+                similarity = 1.0 / (1.0 + float(distance))
+                scores[chunk_id] = max(scores.get(chunk_id, 0.0), similarity)
+            else:
+                raise ValueError(f"Unknown fusion strategy: {fusion}")
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:max_results] if max_results else ranked
+
+
+def fuse_rankings(rankings, max_results=RETRIEVAL_MAX_RESULTS, rrf_k=RRF_K):
+    """Merge ranked lists of chunk ids by reciprocal rank fusion."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:max_results] if max_results else ranked
 
 
 class Retriever:
-    def __init__(self, index_path, vectorizer):
-        self.index = faiss.read_index(index_path)
+    def __init__(
+        self,
+        index_path,
+        vectorizer,
+        mmap=False,
+        nprobe=FAISS_NPROBE,
+        ef_search=FAISS_EF_SEARCH,
+    ):
+        # A memory-mapped index is paged in by the OS and shared between workers
+        self.index = configure_search(read_index(index_path, mmap), nprobe, ef_search)
         self.vectorizer = vectorizer
 
     def retrieve(self, input, chunks, k=2):
         question_embeddings = self.vectorizer.get_text_embedding(input)
 
-        D, I = self.index.search(np.array(question_embeddings), k)
+        with span("search"):
+            D, I = self.index.search(np.array(question_embeddings), k)
         indexes = I.flatten()
 
         retrieved_chunk = [chunks[i] for i in indexes]
 
         return retrieved_chunk
+
+    async def search_async(
+        self, inputs, k=5, fusion="rrf", max_results=RETRIEVAL_MAX_RESULTS
+    ):
+        """Embed all inputs, run one batched search and fuse the hits."""
+        if not inputs:
+            return []
+
+        question_embeddings = await self.vectorizer.get_text_embedding_async(inputs)
+        with span("search"):
+            D, I = await run_blocking(
+                "cpu",
+                self.index.search,
+                np.array(question_embeddings, dtype=np.float32),
+                k,
+            )
+
+        return fuse_results(D, I, fusion=fusion, max_results=max_results)
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import threading
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() not in ("0", "false")
+
+# Every group created, for collect()
+_groups = []
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Share one upstream call among concurrent callers asking for the same key.
+
+    The first caller for a key (the leader) makes the call; callers arriving
+    while it is in flight wait for it and get its result, or its exception.
+    Nothing is kept once the call finishes: results are cached elsewhere.
+
+    Async calls run in their own task. A caller that is cancelled stops
+    waiting without affecting the others, and the upstream call is only
+    cancelled when every caller waiting for it has been.
+    """
+
+    def __init__(self, name, enabled=SINGLE_FLIGHT):
+        self.name = name
+        self.enabled = enabled
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        _groups.append(self)
+
+    def do(self, key, fn, *args, **kwargs):
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Like do, for a coroutine function."""
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or flight.task.get_loop() is not loop:
+                flight = self._flights[key] = _Flight(
+                    asyncio.ensure_future(fn(*args, **kwargs))
+                )
+                flight.task.add_done_callback(lambda task: self._forget(key, flight))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+
+        try:
+            # Shielded, so that cancelling one caller leaves the call running
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller gave up; later callers start a new call
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls) + len(self._flights)
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
+
+
+def collect():
+    """Counters of every group, for metrics.register_collector."""
+    stats = [(group.name, group.stats()) for group in _groups]
+    return [
+        (
+            "pdm_singleflight_calls_total",
+            "counter",
+            "Upstream calls made by single-flight groups",
+            [((("group", name),), s["calls"]) for name, s in stats],
+        ),
+        (
+            "pdm_singleflight_coalesced_total",
+            "counter",
+            "Calls that waited for an identical call already in flight",
+            [((("group", name),), s["coalesced"]) for name, s in stats],
+        ),
+        (
+            "pdm_singleflight_in_flight",
+            "gauge",
+            "Upstream calls currently in flight",
+            [((("group", name),), s["in_flight"]) for name, s in stats],
+        ),
+    ]
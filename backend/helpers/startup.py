@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import time
+
+from helpers.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() not in ("0", "false")
+
+
+class Warmup:
+    """
+    Load resources ahead of the first request and track readiness.
+
+    Every resource is loaded on the IO executor at the same time. A resource
+    that fails to load is logged and left to load on first use, so one
+    unreachable WMS does not keep the service from becoming ready.
+    """
+
+    def __init__(self):
+        self.started_at = None
+        self.ready = False
+        # phase -> seconds since the lifespan started
+        self.durations = {}
+        # resource -> (status, seconds)
+        self.resources = {}
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def mark(self, phase):
+        self.durations[phase] = time.perf_counter() - self.started_at
+
+    async def _load(self, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            await run_blocking("io", fn, *args)
+            status = "ok"
+        except Exception:
+            logger.exception(f"Failed to warm up {name}")
+            status = "failed"
+        self.resources[name] = (status, time.perf_counter() - start)
+
+    async def run(self, loaders):
+        """
+        Args:
+            loaders: {resource name: (function, *args)} to run in parallel.
+        """
+        await asyncio.gather(
+            *(self._load(name, *loader) for name, loader in loaders.items())
+        )
+        self.ready = True
+        self.mark("warmup")
+        failed = [
+            name for name, (status, _) in self.resources.items() if status != "ok"
+        ]
+        logger.info(
+            f"Warm-up finished in {self.durations['warmup']:.2f}s"
+            + (f", failed: {', '.join(failed)}" if failed else "")
+        )
+
+    def skip(self):
+        self.ready = True
+        self.mark("warmup")
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "startup_seconds": self.durations,
+            "resources": {
+                name: {"status": status, "seconds": seconds}
+                for name, (status, seconds) in self.resources.items()
+            },
+        }
+
+    def collect(self):
+        return [
+            (
+                "pdm_startup_seconds",
+                "gauge",
+                "Seconds from startup to each phase (lifespan: serving, warmup: ready)",
+                [
+                    ((("phase", phase),), seconds)
+                    for phase, seconds in self.durations.items()
+                ],
+            ),
+            (
+                "pdm_warmup_resource_seconds",
+                "gauge",
+                "Seconds taken to load each resource during warm-up",
+                [
+                    ((("resource", name), ("status", status)), seconds)
+                    for name, (status, seconds) in self.resources.items()
+                ],
+            ),
+        ]
@@ -0,0 +1,7 @@
+# Rough characters-per-token ratio of Mistral's tokenizer on Portuguese legal text
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text):
+    """Cheap upper-bound style estimate of the number of tokens in a text."""
+    return len(text) // CHARS_PER_TOKEN + 1
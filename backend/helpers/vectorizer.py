@@ -1,31 +1,303 @@
 from mistralai import Mistral
-import requests
+import argparse
+import hashlib
+import httpx
+import json
+import logging
+import random
 import numpy as np
-import faiss
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from helpers.concurrency import run_blocking
+from helpers.embedding_store import EmbeddingStore, embedding_key
+from helpers.faiss_index import FAISS_INDEX_TYPE, INDEX_TYPES, build_index
+from helpers.metrics import span
+from helpers.singleflight import SingleFlight
+from helpers.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Mistral embeddings limits: tokens per input text and per request
+MAX_INPUT_TOKENS = 8192
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 16000))
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 128))
+MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", 4))
+MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+
+
+# Concurrent requests for the same uncached texts share one embeddings call
+embedding_flights = SingleFlight("embed")
+
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections."""
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return isinstance(
+        error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+    )
+
+
+def pack_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_items=MAX_BATCH_SIZE):
+    """Greedily pack texts into batches that stay under the request token budget."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = min(estimate_tokens(text), MAX_INPUT_TOKENS)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
 
 
 class TextVectorizer:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, model="mistral-embed", store=None):
         self.api_key = api_key or os.getenv("MISTRAL_API_KEY")
-        self.client = Mistral(api_key=self.api_key)
+        self._client = None
+        self.model = model
+        self.store = store if store is not None else EmbeddingStore()
+
+    @property
+    def client(self):
+        # Built on first use, so importing the app makes no API client
+        if self._client is None:
+            self._client = Mistral(
+                api_key=self.api_key, server_url=os.getenv("MISTRAL_SERVER_URL")
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def _keys(self, input):
+        texts = [input] if isinstance(input, str) else list(input)
+        return texts, [embedding_key(self.model, text) for text in texts]
+
+    @staticmethod
+    def _missing(texts, keys, cached):
+        # Only texts that are in neither cache tier go to the API
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing[key] = text
+        return missing
+
+    def _lookup(self, input):
+        texts, keys = self._keys(input)
+        cached = self.store.get_many(keys)
+        return keys, cached, self._missing(texts, keys, cached)
+
+    async def _lookup_async(self, input):
+        texts, keys = self._keys(input)
+        # SQLite reads (and the store's lock, shared with embed_many's
+        # workers) stay off the event loop; memory hits need no thread
+        cached = self.store.get_many(keys, disk=False)
+        if len(cached) < len(keys) and self.store.persistent:
+            cached.update(
+                await run_blocking(
+                    "io", self.store.get_many, [k for k in keys if k not in cached]
+                )
+            )
+        return keys, cached, self._missing(texts, keys, cached)
+
+    def _fetched(self, missing, embeddings_batch_response):
+        return [
+            (key, x.embedding)
+            for key, x in zip(missing.keys(), embeddings_batch_response.data)
+        ]
+
+    @staticmethod
+    def _vectors(fetched):
+        return {
+            key: np.asarray(embedding, dtype=np.float32) for key, embedding in fetched
+        }
+
+    def _fetch(self, missing):
+        with span("embed"):
+            embeddings_batch_response = self.client.embeddings.create(
+                model=self.model, inputs=list(missing.values())
+            )
+        fetched = self._fetched(missing, embeddings_batch_response)
+        self.store.put_many(self.model, fetched)
+        return self._vectors(fetched)
+
+    async def _fetch_async(self, missing):
+        with span("embed"):
+            embeddings_batch_response = await self.client.embeddings.create_async(
+                model=self.model, inputs=list(missing.values())
+            )
+        fetched = self._fetched(missing, embeddings_batch_response)
+        await run_blocking("io", self.store.put_many, self.model, fetched)
+        return self._vectors(fetched)
 
     def get_text_embedding(self, input):
-        embeddings_batch_response = self.client.embeddings.create(
-            model="mistral-embed", inputs=input
-        )
+        keys, cached, missing = self._lookup(input)
+
+        if missing:
+            cached.update(
+                embedding_flights.do(
+                    (self.model, *missing.keys()), self._fetch, missing
+                )
+            )
+
+        return [cached[key] for key in keys]
+
+    async def get_text_embedding_async(self, input):
+        keys, cached, missing = await self._lookup_async(input)
 
-        return [x.embedding for x in embeddings_batch_response.data]
+        if missing:
+            cached.update(
+                await embedding_flights.do_async(
+                    (self.model, *missing.keys()), self._fetch_async, missing
+                )
+            )
+
+        return [cached[key] for key in keys]
+
+    def _embed_batch_with_retry(self, batch, max_retries=MAX_RETRIES):
+        for attempt in range(max_retries + 1):
+            try:
+                return self.get_text_embedding(batch)
+            except Exception as error:
+                # Anything else (a bad request, an invalid key) won't go away
+                if attempt == max_retries or not is_retryable(error):
+                    raise
+                # Exponential backoff with jitter, mostly for 429 rate limits
+                delay = 2**attempt + random.uniform(0, 1)
+                logger.warning(f"Embedding batch failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_many(self, texts, max_workers=MAX_WORKERS):
+        """
+        Embed a large list of texts in token-packed batches, with bounded
+        concurrency and retries. Every finished batch is persisted in the
+        embedding store, so an interrupted run resumes where it stopped.
+        """
+        keys = [embedding_key(self.model, text) for text in texts]
+        cached = self.store.get_many(keys)
+        missing = list(dict.fromkeys(t for k, t in zip(keys, texts) if k not in cached))
+
+        batches = pack_batches(missing)
+        if batches:
+            logger.info(
+                f"Embedding {len(missing)} texts in {len(batches)} batches "
+                f"({len(cached)} already cached)"
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._embed_batch_with_retry, batch): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                for text, vector in zip(batch, future.result()):
+                    cached[embedding_key(self.model, text)] = vector
+
+        return np.array([cached[key] for key in keys], dtype=np.float32)
 
     def get_embeddings(self, chunks):
-        return np.array([self.get_text_embedding(chunk) for chunk in chunks])
+        return self.embed_many(chunks)
+
+    def save_embeddings_to_db(self, text_embeddings, db_path, index_type="flat"):
+        import faiss
+
+        faiss.write_index(build_index(text_embeddings, index_type), db_path)
+
+    def build_index(self, chunks, db_path, index_type=FAISS_INDEX_TYPE):
+        """
+        Build or incrementally update the FAISS index for the given chunks.
+
+        A manifest next to the index records the hash of every chunk's text.
+        Vectors of unchanged chunks are reused and only new or edited chunks
+        are embedded. Approximate index types don't keep the exact vectors,
+        so they are also saved next to the index for the next update.
+        """
+        manifest_path = f"{db_path}.manifest.json"
+        vectors_path = f"{db_path}.vectors.npy"
+        hashes = [hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in chunks]
+
+        previous = {}
+        old_vectors = None
+        if os.path.exists(db_path) and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("model") == self.model:
+                if manifest.get("index_type", "flat") == "flat":
+                    import faiss
+
+                    old_index = faiss.read_index(db_path)
+                    old_vectors = old_index.reconstruct_n(0, old_index.ntotal)
+                    previous = {h: i for i, h in enumerate(manifest["chunks"])}
+                elif os.path.exists(vectors_path):
+                    old_vectors = np.load(vectors_path)
+                    previous = {h: i for i, h in enumerate(manifest["chunks"])}
+
+        reused = {}
+        to_embed = []
+        for chunk, chunk_hash in zip(chunks, hashes):
+            if chunk_hash in previous:
+                reused[chunk_hash] = old_vectors[previous[chunk_hash]]
+            else:
+                to_embed.append(chunk)
+
+        logger.info(f"Reusing {len(reused)} vectors, embedding {len(to_embed)} chunks")
+        embedded = dict(zip(to_embed, self.embed_many(to_embed))) if to_embed else {}
+
+        text_embeddings = np.array(
+            [
+                reused[h] if h in reused else embedded[chunk]
+                for chunk, h in zip(chunks, hashes)
+            ],
+            dtype=np.float32,
+        )
+
+        tmp_path = f"{db_path}.tmp"
+        self.save_embeddings_to_db(text_embeddings, tmp_path, index_type)
+        os.replace(tmp_path, db_path)
+        if index_type == "flat":
+            if os.path.exists(vectors_path):
+                os.remove(vectors_path)
+        else:
+            np.save(vectors_path, text_embeddings)
+        with open(manifest_path, "w") as f:
+            json.dump(
+                {"model": self.model, "index_type": index_type, "chunks": hashes}, f
+            )
+
+        return text_embeddings
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Build or update the FAISS index of a chunk file."
+    )
+    parser.add_argument(
+        "chunks_path", help="Text file with chunks separated by blank lines"
+    )
+    parser.add_argument("db_path", help="FAISS index to write")
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default=FAISS_INDEX_TYPE,
+        help="Exact (flat), scalar-quantized (fp16, sq8) or approximate index",
+    )
+    args = parser.parse_args()
 
-    def save_embeddings_to_db(self, text_embeddings, db_path):
-        d = text_embeddings.shape[1]
-        index = faiss.IndexFlatL2(d)
-        index.add(text_embeddings)
-        faiss.write_index(index, db_path)
+    chunks = open(args.chunks_path).read().split("\n\n")
+    TextVectorizer().build_index(chunks, args.db_path, args.index_type)
+    print(f"Index saved to {args.db_path}")
 
 
 # Usage example:
@@ -1,14 +1,332 @@
-from owslib.wms import WebMapService
-import requests
-import json
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import httpx
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import namedtuple
+from urllib.parse import urlsplit
+from helpers.cache import LRUCache
+from helpers.concurrency import run_blocking
+from helpers.config import municipalities
+from helpers.feature_store import (
+    FEATURE_SNAPSHOT_MAX_AGE,
+    capabilities_fingerprint,
+    get_feature_store,
+    loaded_feature_store,
+)
+from helpers.metrics import timed
+from helpers.singleflight import SingleFlight
 
-municipalities = json.load(open("data/municipalities_configs.json"))
+logger = logging.getLogger(__name__)
+
+CAPABILITIES_TTL = float(os.getenv("WMS_CAPABILITIES_TTL", 3600))
+CAPABILITIES_SNAPSHOT_DIR = os.getenv("WMS_CAPABILITIES_SNAPSHOT_DIR")
+
+PROPERTIES_CACHE_SIZE = int(os.getenv("WMS_PROPERTIES_CACHE_SIZE", 10000))
+PROPERTIES_TTL = float(os.getenv("WMS_PROPERTIES_TTL", 86400))
+PROPERTIES_GRID_RESOLUTION = float(os.getenv("WMS_PROPERTIES_GRID_RESOLUTION", 0.0001))
+
+LAYER_TIMEOUT = float(os.getenv("WMS_LAYER_TIMEOUT", 10))
+MAX_CONCURRENCY = int(os.getenv("WMS_MAX_CONCURRENCY", 32))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("WMS_MAX_CONNECTIONS_PER_HOST", 16))
+
+FEATURE_INFO_MODE = os.getenv("WMS_FEATURE_INFO_MODE", "single")
+MULTI_LAYER_CHUNK_SIZE = int(os.getenv("WMS_MULTI_LAYER_CHUNK_SIZE", 20))
+# Extra features requested per layer in multi-layer mode, since some servers
+# apply FEATURE_COUNT to the whole response rather than to each layer
+MULTI_LAYER_FEATURE_HEADROOM = 5
+
+PROPERTIES_BACKEND = os.getenv("WMS_PROPERTIES_BACKEND", "remote")
+
+LAYER_INDEX_GRID_SIZE = int(os.getenv("WMS_LAYER_INDEX_GRID_SIZE", 64))
+# Cells in which empty layers are learned; 0 uses the properties cache grid.
+# Coarser cells skip more requests but can hide features smaller than a cell
+NEGATIVE_CACHE_CELL_SIZE = float(os.getenv("WMS_NEGATIVE_CACHE_CELL_SIZE", 0))
+NEGATIVE_CACHE_MIN_EMPTY = int(os.getenv("WMS_NEGATIVE_CACHE_MIN_EMPTY", 3))
+NEGATIVE_CACHE_TTL = float(os.getenv("WMS_NEGATIVE_CACHE_TTL", 86400))
+# Share of lookups that still query a known-empty layer, so a feature found
+# there clears the entry instead of staying hidden until it expires
+NEGATIVE_CACHE_RECHECK = float(os.getenv("WMS_NEGATIVE_CACHE_RECHECK", 0.1))
+
+
+class LayerIndex:
+    """
+    Uniform grid over the layers' WGS84 bounding boxes.
+
+    Each cell lists the layers whose extent overlaps it, so looking up the
+    layers that contain a point only checks a handful of bounding boxes
+    instead of every layer the service exposes.
+    """
+
+    def __init__(self, contents, grid_size=LAYER_INDEX_GRID_SIZE):
+        self.grid_size = grid_size
+        self.bounding_boxes = {}
+        for name, layer in contents.items():
+            if layer.boundingBoxWGS84:
+                self.bounding_boxes[name] = tuple(layer.boundingBoxWGS84[:4])
+
+        self.cells = {}
+        if not self.bounding_boxes:
+            return
+
+        boxes = self.bounding_boxes.values()
+        self.min_lon = min(box[0] for box in boxes)
+        self.min_lat = min(box[1] for box in boxes)
+        self.cell_width = (max(box[2] for box in boxes) - self.min_lon) / grid_size
+        self.cell_height = (max(box[3] for box in boxes) - self.min_lat) / grid_size
+
+        # Layers are appended in capabilities order, which lookups preserve
+        for name, (min_lon, min_lat, max_lon, max_lat) in self.bounding_boxes.items():
+            min_x, min_y = self._cell(min_lon, min_lat)
+            max_x, max_y = self._cell(max_lon, max_lat)
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    self.cells.setdefault((x, y), []).append(name)
+
+    def _cell(self, lon, lat):
+        x = int((lon - self.min_lon) / self.cell_width) if self.cell_width else 0
+        y = int((lat - self.min_lat) / self.cell_height) if self.cell_height else 0
+        return (
+            min(max(x, 0), self.grid_size - 1),
+            min(max(y, 0), self.grid_size - 1),
+        )
+
+    def layers_at(self, lon, lat):
+        if not self.cells:
+            return []
+
+        layers = []
+        for name in self.cells.get(self._cell(lon, lat), []):
+            min_lon, min_lat, max_lon, max_lat = self.bounding_boxes[name]
+            if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+                layers.append(name)
+        return layers
+
+    def contains(self, layer_name, lon, lat):
+        box = self.bounding_boxes.get(layer_name)
+        return box is not None and box[0] <= lon <= box[2] and box[1] <= lat <= box[3]
+
+
+CapabilitiesEntry = namedtuple(
+    "CapabilitiesEntry", ["wms", "fetched_at", "layer_index"]
+)
+
+
+class CapabilitiesCache:
+    """
+    Process-wide cache of parsed GetCapabilities documents, keyed by municipality.
+
+    Entries older than their TTL are still served while a single background
+    thread refreshes them (stale-while-revalidate). When a snapshot directory
+    is configured the raw capabilities XML is also written to disk so that a
+    cold process can start from the last known copy instead of the network.
+    """
+
+    def __init__(self, ttl=CAPABILITIES_TTL, snapshot_dir=CAPABILITIES_SNAPSHOT_DIR):
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._refreshing = set()
+
+    def get(self, municipality):
+        return self.get_entry(municipality).wms
+
+    def get_entry(self, municipality):
+        entry = self._entries.get(municipality)
+        if entry is None:
+            return self._load(municipality)
+
+        if time.time() - entry.fetched_at > self._ttl_for(municipality):
+            self._refresh_in_background(municipality)
+        return entry
+
+    def invalidate(self, municipality=None):
+        with self._lock:
+            if municipality is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(municipality, None)
+
+    def _ttl_for(self, municipality):
+        return float(municipalities[municipality].get("capabilities_ttl", self.ttl))
+
+    def _load_lock(self, municipality):
+        with self._lock:
+            return self._load_locks.setdefault(municipality, threading.Lock())
+
+    def _load(self, municipality):
+        # Only one thread per municipality pays for the initial download
+        with self._load_lock(municipality):
+            entry = self._entries.get(municipality)
+            if entry is not None:
+                return entry
+
+            entry = self._read_snapshot(municipality)
+            if entry is not None:
+                self._entries[municipality] = entry
+                if time.time() - entry.fetched_at > self._ttl_for(municipality):
+                    self._refresh_in_background(municipality)
+                return entry
+
+            return self._fetch(municipality)
+
+    @timed("capabilities")
+    def _fetch(self, municipality):
+        from owslib.wms import WebMapService
+
+        params = municipalities[municipality]
+        wms = WebMapService(params["wms_url"], version=params["wms_version"])
+        entry = CapabilitiesEntry(wms, time.time(), LayerIndex(wms.contents))
+        self._entries[municipality] = entry
+        self._write_snapshot(municipality, wms)
+        return entry
+
+    def _refresh_in_background(self, municipality):
+        with self._lock:
+            if municipality in self._refreshing:
+                return
+            self._refreshing.add(municipality)
+
+        def refresh():
+            try:
+                self._fetch(municipality)
+            except Exception:
+                logger.exception(f"Failed to refresh capabilities for {municipality}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(municipality)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _snapshot_path(self, municipality):
+        return os.path.join(self.snapshot_dir, f"{municipality}_capabilities.xml")
+
+    def _read_snapshot(self, municipality):
+        if not self.snapshot_dir:
+            return None
+
+        path = self._snapshot_path(municipality)
+        if not os.path.exists(path):
+            return None
+
+        from owslib.wms import WebMapService
+
+        params = municipalities[municipality]
+        try:
+            with open(path, "rb") as f:
+                xml = f.read()
+            wms = WebMapService(
+                params["wms_url"], version=params["wms_version"], xml=xml
+            )
+        except Exception:
+            logger.exception(f"Ignoring unreadable capabilities snapshot {path}")
+            return None
+
+        return CapabilitiesEntry(wms, os.path.getmtime(path), LayerIndex(wms.contents))
+
+    def _write_snapshot(self, municipality, wms):
+        if not self.snapshot_dir:
+            return
+
+        xml = wms.getServiceXML()
+        if not xml:
+            return
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = self._snapshot_path(municipality)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(xml)
+        os.replace(tmp_path, path)
+
+
+capabilities_cache = CapabilitiesCache()
+
+# GetFeatureInfo results per (municipality, layer, margin, snapped cell)
+properties_cache = LRUCache(maxsize=PROPERTIES_CACHE_SIZE)
+
+
+class AsyncHTTPPool:
+    """
+    One pooled httpx.AsyncClient per WMS host plus a global semaphore capping
+    the number of in-flight GetFeatureInfo requests. Both are bound to the
+    event loop they were created on.
+    """
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        self.clients = {}
+
+    def client_for(self, url):
+        host = urlsplit(url).netloc
+        client = self.clients.get(host)
+        if client is None:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS_PER_HOST,
+                    max_keepalive_connections=MAX_CONNECTIONS_PER_HOST,
+                ),
+                timeout=LAYER_TIMEOUT,
+            )
+            self.clients[host] = client
+        return client
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def _async_pool():
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = _async_pools[loop] = AsyncHTTPPool()
+    return pool
+
+
+async def close_async_pool():
+    """Close the pooled clients of the running event loop (call on shutdown)."""
+    pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
+
+
+# Consecutive empty GetFeatureInfo results per (municipality, layer, cell)
+empty_results_cache = LRUCache(maxsize=PROPERTIES_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL)
+
+# Municipalities whose WMS refused a multi-layer GetFeatureInfo in this process
+multi_layer_rejected = set()
+
+
+def invalidate_properties(municipality=None, layer_name=None):
+    """Drop cached GetFeatureInfo results, optionally for one municipality/layer."""
+
+    def matches(key):
+        return (municipality is None or key[0] == municipality) and (
+            layer_name is None or key[1] == layer_name
+        )
+
+    empty_results_cache.invalidate(matches)
+    return properties_cache.invalidate(matches)
+
+
+# Concurrent lookups of the same cell and layers share one GetFeatureInfo fan-out
+feature_info_flights = SingleFlight("wms")
 
 
 class WMService:
     def __init__(self, municipality):
 
+        self.municipality = municipality
         self.municipality_params = municipalities[municipality]
         self.wms_url = self.municipality_params["wms_url"]
         self.wms_version = self.municipality_params["wms_version"]
@@ -16,72 +334,362 @@ class WMService:
         self.image_height = self.municipality_params["image_height"]
         self.info_format = self.municipality_params["info_format"]
 
-        self.wms = WebMapService(self.wms_url, version=self.wms_version)
+        self.grid_resolution = float(
+            self.municipality_params.get(
+                "cache_grid_resolution", PROPERTIES_GRID_RESOLUTION
+            )
+        )
+        self.properties_ttl = float(
+            self.municipality_params.get("properties_ttl", PROPERTIES_TTL)
+        )
+        self.layer_ttls = self.municipality_params.get("layer_ttls", {})
+        self.layer_timeout = float(
+            self.municipality_params.get("layer_timeout", LAYER_TIMEOUT)
+        )
+        self.feature_info_mode = self.municipality_params.get(
+            "feature_info_mode", FEATURE_INFO_MODE
+        )
+        self.multi_layer_chunk_size = int(
+            self.municipality_params.get(
+                "multi_layer_chunk_size", MULTI_LAYER_CHUNK_SIZE
+            )
+        )
+        self.feature_count = int(self.municipality_params.get("feature_count", 1))
+
+        self.properties_backend = self.municipality_params.get(
+            "properties_backend", PROPERTIES_BACKEND
+        )
+        self.feature_snapshot_max_age = float(
+            self.municipality_params.get(
+                "feature_snapshot_max_age", FEATURE_SNAPSHOT_MAX_AGE
+            )
+        )
+
+        self.negative_cache_cell_size = (
+            float(
+                self.municipality_params.get(
+                    "negative_cache_cell_size", NEGATIVE_CACHE_CELL_SIZE
+                )
+            )
+            or self.grid_resolution
+        )
+
+        capabilities = capabilities_cache.get_entry(municipality)
+        self.wms = capabilities.wms
+        self.layer_index = capabilities.layer_index
+
+    def _cache_key(self, layer_name, coords):
+        # Snap the click to a grid cell so nearby clicks share the same entry
+        cell_x = int(coords.lon // self.grid_resolution)
+        cell_y = int(coords.lat // self.grid_resolution)
+        return (self.municipality, layer_name, coords.margin, cell_x, cell_y)
+
+    def _flight_key(self, coords, layers_to_fetch):
+        # Same cell as the properties cache, so waiters get what it would hold
+        cell_x = int(coords.lon // self.grid_resolution)
+        cell_y = int(coords.lat // self.grid_resolution)
+        return (
+            self.municipality,
+            coords.margin,
+            cell_x,
+            cell_y,
+            tuple(layers_to_fetch),
+        )
+
+    def _empty_key(self, layer_name, coords):
+        cell_x = int(coords.lon // self.negative_cache_cell_size)
+        cell_y = int(coords.lat // self.negative_cache_cell_size)
+        return (self.municipality, layer_name, cell_x, cell_y)
 
-    def get_properties(self, coords, layer_name=None):
+    def _known_empty(self, layer_name, coords):
+        empty_count = empty_results_cache.get(self._empty_key(layer_name, coords), 0)
+        return (
+            empty_count >= NEGATIVE_CACHE_MIN_EMPTY
+            and random.random() >= NEGATIVE_CACHE_RECHECK
+        )
+
+    def _record_result(self, layer_name, coords, properties):
+        # Learn which layers keep coming back empty around here, and forget it
+        # as soon as a query (including a recheck) returns something
+        key = self._empty_key(layer_name, coords)
+        if properties:
+            empty_results_cache.delete(key)
+        else:
+            empty_results_cache.set(key, empty_results_cache.get(key, 0) + 1)
+
+    def _local_store(self):
+        """The harvested feature snapshot, when the local backend may use it."""
+        if self.properties_backend != "local":
+            return None
+
+        store = get_feature_store(self.municipality, self.municipality_params)
+        if store is None or not store.is_fresh(self.wms, self.feature_snapshot_max_age):
+            return None
+        return store
+
+    def _layer_ttl(self, layer_name):
+        return float(self.layer_ttls.get(layer_name, self.properties_ttl))
+
+    def _feature_info_params(self, layer_name, coords):
         # Calculate custom bounding box around the coordinate of interest
         min_lon = coords.lon - coords.margin
         max_lon = coords.lon + coords.margin
         min_lat = coords.lat - coords.margin
         max_lat = coords.lat + coords.margin
 
-        # Create the bounding box parameter
-        bbox_parameter = f"{min_lon},{min_lat},{max_lon},{max_lat}"
+        return {
+            "service": "WMS",
+            "version": self.wms_version,
+            "request": "GetFeatureInfo",
+            "layers": layer_name,
+            "query_layers": layer_name,
+            "bbox": f"{min_lon},{min_lat},{max_lon},{max_lat}",
+            "width": self.image_width,
+            "height": self.image_height,
+            "srs": "EPSG:4326",
+            "x": self.image_width // 2,
+            "y": self.image_height // 2,
+            "info_format": self.info_format,
+        }
 
-        # List to store all properties data
-        all_properties = {}
+    def _parse_feature_info(self, layer_name, response_data):
+        return self._layer_properties(layer_name, response_data.get("features", []))
 
-        # Determine which layers to query
-        layers_to_query = [layer_name] if layer_name else self.wms.contents.keys()
+    def _layer_properties(self, layer_name, features):
+        layer_metadata = self.wms.contents[layer_name]
+        properties = []
+        for feature in features:
+            feature["properties"]["nome"] = layer_metadata.title
+            feature["properties"]["abstract"] = layer_metadata.abstract
+            properties.append(feature["properties"])
+        return properties
 
-        def fetch_layer_properties(layer_name):
-            layer_metadata = self.wms.contents[layer_name]
-            bounding_box = layer_metadata.boundingBoxWGS84
-            min_lon, min_lat, max_lon, max_lat = bounding_box
+    def _use_multi_layer(self, layers_to_fetch):
+        return (
+            self.feature_info_mode == "multi"
+            and self.municipality not in multi_layer_rejected
+            and len(layers_to_fetch) > 1
+        )
 
-            if not (
-                min_lon <= coords.lon <= max_lon and min_lat <= coords.lat <= max_lat
-            ):
-                return None
+    def _chunk_layers(self, layers_to_fetch):
+        size = self.multi_layer_chunk_size
+        return [
+            layers_to_fetch[i : i + size] for i in range(0, len(layers_to_fetch), size)
+        ]
 
-            params = {
-                "service": "WMS",
-                "version": self.wms_version,
-                "request": "GetFeatureInfo",
-                "layers": layer_name,
-                "query_layers": layer_name,
-                "bbox": bbox_parameter,
-                "width": self.image_width,
-                "height": self.image_height,
-                "srs": "EPSG:4326",
-                "x": self.image_width // 2,
-                "y": self.image_height // 2,
-                "info_format": self.info_format,
-            }
-
-            response = requests.get(self.wms_url, params=params)
-            try:
-                response_data = response.json()
-                properties = []
-                for feature in response_data.get("features", []):
-                    feature["properties"]["nome"] = self.wms.contents[layer_name].title
-                    feature["properties"]["abstract"] = self.wms.contents[
-                        layer_name
-                    ].abstract
-                    properties.append(feature["properties"])
-                return layer_name, properties
-            except:
+    def _multi_layer_params(self, chunk, coords):
+        params = self._feature_info_params(",".join(chunk), coords)
+        params["feature_count"] = len(chunk) * (
+            self.feature_count + MULTI_LAYER_FEATURE_HEADROOM
+        )
+        return params
+
+    def _demultiplex(self, chunk, response):
+        """
+        Split a multi-layer GetFeatureInfo response back into per-layer results.
+
+        Features are matched to layers through their GeoJSON id, which WMS
+        servers such as GeoServer prefix with the unqualified layer name.
+        Returns None when the response can't be attributed, so the caller can
+        fall back to one request per layer.
+        """
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+
+        if (
+            response.status_code >= 400
+            or not isinstance(response_data, dict)
+            or "features" not in response_data
+        ):
+            logger.warning(
+                f"{self.municipality} WMS rejected a multi-layer GetFeatureInfo, "
+                "falling back to per-layer requests"
+            )
+            multi_layer_rejected.add(self.municipality)
+            return None
+
+        layers_by_prefix = {name.split(":")[-1]: name for name in chunk}
+        features_by_layer = {name: [] for name in chunk}
+        for feature in response_data["features"]:
+            prefix = str(feature.get("id", "")).rsplit(".", 1)[0].split(":")[-1]
+            layer_name = layers_by_prefix.get(prefix)
+            if layer_name is None:
+                # Ids that don't name the layer will not on the next click
+                # either, so stop paying for the multi-layer request
+                logger.warning(
+                    f"{self.municipality} WMS returned feature id {feature.get('id')!r} "
+                    "that matches no requested layer, falling back to per-layer "
+                    "requests"
+                )
+                multi_layer_rejected.add(self.municipality)
                 return None
+            features_by_layer[layer_name].append(feature)
+
+        return [
+            (name, self._layer_properties(name, features[: self.feature_count]))
+            for name, features in features_by_layer.items()
+        ]
 
-        with ThreadPoolExecutor(max_workers=len(layers_to_query)) as executor:
-            results = executor.map(fetch_layer_properties, layers_to_query)
+    def _plan_query(self, coords, layer_name=None):
+        """
+        Split the candidate layers into cached results and layers to fetch.
 
+        Returns the in-extent layers (in capabilities order), the cached
+        properties by layer and the layers that still need a GetFeatureInfo.
+        """
+        # Determine which layers contain the point
+        if layer_name:
+            layers_in_extent = (
+                [layer_name]
+                if self.layer_index.contains(layer_name, coords.lon, coords.lat)
+                else []
+            )
+        else:
+            layers_in_extent = self.layer_index.layers_at(coords.lon, coords.lat)
+
+        # Answer harvested layers locally when a fresh snapshot is available
+        cached_properties = {}
+        store = self._local_store()
+        if store is not None:
+            local_results = store.query(coords.lon, coords.lat, layers_in_extent)
+            for name, properties in local_results.items():
+                cached_properties[name] = self._layer_properties(
+                    name, [{"properties": p} for p in properties]
+                )
+
+        # Serve what we can from the caches and only go upstream for the rest
+        layers_to_fetch = []
+        for name in layers_in_extent:
+            if name in cached_properties:
+                continue
+            properties = properties_cache.get(self._cache_key(name, coords))
+            if properties is not None:
+                cached_properties[name] = properties
+            elif self._known_empty(name, coords):
+                cached_properties[name] = []
+            else:
+                layers_to_fetch.append(name)
+
+        return layers_in_extent, cached_properties, layers_to_fetch
+
+    def _store_results(self, coords, results):
+        """Cache the fetched layers and return their properties by layer."""
+        fetched_properties = {}
         for result in results:
             if result:
                 layer_name, properties = result
-                all_properties[layer_name] = properties
+                fetched_properties[layer_name] = properties
+                self._record_result(layer_name, coords, properties)
+                properties_cache.set(
+                    self._cache_key(layer_name, coords),
+                    properties,
+                    ttl=self._layer_ttl(layer_name),
+                )
+        return fetched_properties
+
+    def _merge_results(self, layers_in_extent, cached_properties, fetched_properties):
+        # Dictionary to store all properties data
+        all_properties = {}
+        for name in layers_in_extent:
+            if name in cached_properties:
+                all_properties[name] = cached_properties[name]
+            elif name in fetched_properties:
+                all_properties[name] = fetched_properties[name]
 
         return all_properties
 
+    @timed("wms")
+    async def get_properties_async(self, coords, layer_name=None):
+        """
+        Properties of every layer at the coordinates (or only layer_name), by
+        layer. Layers are served from the local feature store and the caches
+        where possible; the rest are fetched with GetFeatureInfo on the event
+        loop, through a shared, bounded connection pool for the WMS host.
+        """
+        if self.properties_backend == "local":
+            store = loaded_feature_store(self.municipality, self.municipality_params)
+            if store is None:
+                # Reading and indexing the snapshot takes seconds; keep it off the loop
+                store = await run_blocking(
+                    "io", get_feature_store, self.municipality, self.municipality_params
+                )
+            if store is not None and not store.checked(self.wms):
+                # So does hashing a large capabilities document
+                fingerprint = await run_blocking(
+                    "cpu", capabilities_fingerprint, self.wms
+                )
+                store.check(self.wms, fingerprint)
+
+        layers_in_extent, cached_properties, layers_to_fetch = self._plan_query(
+            coords, layer_name
+        )
+
+        fetched_properties = {}
+        if layers_to_fetch:
+            fetched_properties = await feature_info_flights.do_async(
+                self._flight_key(coords, layers_to_fetch),
+                self._fetch_properties_async,
+                coords,
+                layers_to_fetch,
+            )
+
+        return self._merge_results(
+            layers_in_extent, cached_properties, fetched_properties
+        )
+
+    async def _fetch_properties_async(self, coords, layers_to_fetch):
+        """GetFeatureInfo fan-out for the layers; returns properties by layer."""
+        pool = _async_pool()
+        client = pool.client_for(self.wms_url)
+
+        async def fetch_layer_properties(layer_name):
+            params = self._feature_info_params(layer_name, coords)
+            try:
+                async with pool.semaphore:
+                    response = await asyncio.wait_for(
+                        client.get(self.wms_url, params=params),
+                        timeout=self.layer_timeout,
+                    )
+                return layer_name, self._parse_feature_info(layer_name, response.json())
+            except Exception:
+                logger.debug(f"GetFeatureInfo failed for {layer_name}", exc_info=True)
+                return None
+
+        async def fetch_chunk_properties(chunk):
+            params = self._multi_layer_params(chunk, coords)
+            try:
+                async with pool.semaphore:
+                    response = await asyncio.wait_for(
+                        client.get(self.wms_url, params=params),
+                        timeout=self.layer_timeout,
+                    )
+                return self._demultiplex(chunk, response)
+            except Exception:
+                logger.debug(f"GetFeatureInfo failed for {chunk}", exc_info=True)
+                return None
+
+        results = []
+        if self._use_multi_layer(layers_to_fetch):
+            chunks = self._chunk_layers(layers_to_fetch)
+            layers_to_fetch = []
+            chunk_results = await asyncio.gather(
+                *[fetch_chunk_properties(chunk) for chunk in chunks]
+            )
+            for chunk, chunk_result in zip(chunks, chunk_results):
+                if chunk_result is None:
+                    layers_to_fetch.extend(chunk)
+                else:
+                    results.extend(chunk_result)
+
+        results.extend(
+            await asyncio.gather(
+                *[fetch_layer_properties(name) for name in layers_to_fetch]
+            )
+        )
+
+        return self._store_results(coords, results)
+
     def get_contents(self):
         return self.wms.contents
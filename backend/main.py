@@ -1,38 +1,63 @@
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
+from contextlib import asynccontextmanager
+import json
 import os
 import logging
+import time
+from helpers import metrics, singleflight
+from helpers.answer_cache import AnswerCache, normalize_question
+from helpers.batch import (
+    BATCH_GENERATION_CONCURRENCY,
+    BATCH_MAX_ITEMS,
+    BatchJob,
+    BatchJobStore,
+)
+from helpers.concurrency import run_blocking, shutdown_executors
+from helpers.config import municipalities
+from helpers.context import load_tokenizer, pack_context, token_budget_for
+from helpers.corpus import CorpusRegistry, collect_retrieval
+from helpers.feature_store import get_feature_store
 from helpers.generator import Generator
-from helpers.retriever import Retriever
+from helpers.lexical import cited_articles
+from helpers.quota import refund_question, reserve_question
+from helpers.response_writer import ResponseWriter
+from helpers.startup import STARTUP_WARMUP, Warmup
 from helpers.vectorizer import TextVectorizer
-from helpers.wms import WMService
-from datetime import datetime
+from helpers.wms import (
+    PROPERTIES_BACKEND,
+    WMService,
+    close_async_pool,
+    empty_results_cache,
+    properties_cache,
+)
 from dotenv import load_dotenv
 from jose import jwt, JWTError
-from models import Response, UserRequestCount, SessionLocal, Base, engine
-from sqlalchemy.orm import Session
+from models import Response, UserRequestCount, AsyncSessionLocal, create_tables
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("NEXTAUTH_SECRET")
 ALGORITHM = "HS256"
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; LOG_LEVEL=DEBUG adds per-request details
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
-# Create the database tables if they do not already exist
-Base.metadata.create_all(bind=engine)
+# Paths served without a token
+PUBLIC_PATHS = {"/metrics", "/ready"}
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 class JWTMiddleware:
@@ -40,18 +65,15 @@ class JWTMiddleware:
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        if scope["type"] == "http":
+        if scope["type"] == "http" and scope["path"] not in PUBLIC_PATHS:
             request = Request(scope, receive)
             auth_header = request.headers.get("Authorization")
-            logging.info("Auth header:")
-            logging.info(auth_header)
             if auth_header:
                 try:
                     # Extract the token from the "Bearer" scheme
                     token = auth_header.split(" ")[1]
-                    logging.info(token)
                     payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-                    logging.info(payload)
+                    logger.debug("Authenticated user %s", payload.get("id"))
                     scope["user"] = payload  # Add decoded user info to the scope
 
                 except Exception as e:
@@ -72,7 +94,96 @@ class JWTMiddleware:
         await self.app(scope, receive, send)
 
 
-app = FastAPI()
+class MetricsMiddleware:
+    """Time every request and report its pipeline stages in Server-Timing."""
+
+    def __init__(self, app: FastAPI):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        spans = metrics.start_request()
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    metrics.server_timing(spans, time.perf_counter() - start),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # Label by route template, not by raw path, to bound the series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route,
+                status=status,
+            )
+
+
+response_writer = ResponseWriter(AsyncSessionLocal)
+
+warmup = Warmup()
+
+
+def warmup_loaders():
+    """
+    Retrieval corpora, WMS capabilities and local feature snapshots of every
+    configured municipality, and the tokenizer used to pack prompts.
+    """
+    loaders = {"tokenizer": (load_tokenizer,)}
+    for municipality in list(municipalities)[: corpora.max_loaded]:
+        loaders[f"corpus:{municipality}"] = (corpora.get, municipality)
+    for municipality, params in municipalities.items():
+        if "wms_url" in params:
+            loaders[f"capabilities:{municipality}"] = (WMService, municipality)
+        if params.get("properties_backend", PROPERTIES_BACKEND) == "local":
+            loaders[f"features:{municipality}"] = (
+                get_feature_store,
+                municipality,
+                params,
+            )
+    return loaders
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup.start()
+    await create_tables()
+    await response_writer.start()
+    # Serve right away; /ready reports 503 until the resources are loaded
+    if STARTUP_WARMUP:
+        warmup_task = asyncio.create_task(warmup.run(warmup_loaders()))
+    else:
+        warmup_task = None
+        warmup.skip()
+    warmup.mark("lifespan")
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    # Interrupted batches refund their in-flight questions
+    for task in list(batch_tasks):
+        task.cancel()
+    await asyncio.gather(*batch_tasks, return_exceptions=True)
+    # Queued responses are written before the process exits
+    await response_writer.stop()
+    await close_async_pool()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(JWTMiddleware)
 
@@ -88,8 +199,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 
 DEFAULT_MARGIN = 0.001
 
@@ -98,12 +212,45 @@ api_key = os.getenv("MISTRAL_API_KEY")
 
 vectorizer = TextVectorizer(api_key=api_key)
 
-retriever = Retriever("data/artigos_embeddings.faiss", vectorizer)
-
-enriched_articles = open("data/enriched_articles.txt").read().split("\n\n")
+corpora = CorpusRegistry(vectorizer)
 
 generator = Generator(api_key=api_key, model="mistral-large-latest")
 
+answer_cache = AnswerCache(vectorizer)
+
+# Keeps refunds scheduled from cancelled streams alive until they finish
+pending_refunds = set()
+
+# Keeps answer cache writes alive until they finish
+pending_cache_writes = set()
+
+batch_jobs = BatchJobStore()
+
+# Keeps running batch jobs alive until they finish
+batch_tasks = set()
+
+for name, documentation, stats in (
+    ("properties_cache", "WMS GetFeatureInfo result cache", properties_cache.stats),
+    ("empty_results_cache", "WMS empty-cell cache", empty_results_cache.stats),
+    ("embedding_cache", "In-memory embedding cache", vectorizer.store.stats),
+    ("answer_cache", "Generated answer cache", answer_cache.stats),
+    ("response_writer", "Write-behind response queue", response_writer.stats),
+):
+    metrics.register_collector(metrics.stats_collector(name, documentation, stats))
+metrics.register_collector(warmup.collect)
+metrics.register_collector(collect_retrieval)
+metrics.register_collector(singleflight.collect)
+metrics.register_collector(
+    lambda: [
+        (
+            "pdm_corpora_loaded",
+            "gauge",
+            "Retrieval corpora currently loaded",
+            [((), len(corpora.loaded()))],
+        )
+    ]
+)
+
 
 class Coordinates(BaseModel):
     lat: float
@@ -116,6 +263,13 @@ class QuestionRequest(BaseModel):
     question: str
     properties: dict
     coords: Coordinates
+    fresh: bool = False  # Skip the answer cache and always generate
+
+
+class BatchRequest(BaseModel):
+    locations: List[Coordinates]
+    questions: List[str]
+    fresh: bool = False
 
 
 def parse_properties_for_model(properties):
@@ -137,21 +291,308 @@ def parse_properties_for_model(properties):
     return concatenated_properties_list
 
 
-def get_all_relevant_chunks(layers_formatted):
-    all_relevant_chunks = []
+async def get_all_relevant_chunks(layers_formatted, municipality, question=None):
+    # Loading a corpus the first time reads the index from disk
+    corpus = await run_blocking("io", corpora.get, municipality)
+    # [(chunk, score)], most relevant first; articles the question cites lead
+    return await corpus.retrieve_async(layers_formatted, question=question, k=5)
+
+
+async def build_answer_context(question_request):
+    """
+    Parse the location, then either find a cached answer or retrieve the
+    relevant articles and build the prompt.
+
+    Returns:
+        tuple: (parsed_properties, articles, prompt, cached_answer). Exactly
+        one of prompt and cached_answer is None.
+    """
+    parsed_properties = parse_properties_for_model(question_request.properties)
+    municipality = question_request.coords.municipality
+
+    if not question_request.fresh:
+        cached_answer = await answer_cache.get_async(
+            municipality, parsed_properties, question_request.question
+        )
+        if cached_answer is not None:
+            logger.debug("Serving cached answer...")
+            return (
+                parsed_properties,
+                cached_answer["articles"],
+                None,
+                cached_answer["answer"],
+            )
+
+    layers_formatted = "\n".join(parsed_properties)
+
+    relevant_chunks = await get_all_relevant_chunks(
+        parsed_properties, municipality, question_request.question
+    )
+
+    logger.debug("Generating prompt...")
+
+    context = pack_context(relevant_chunks, token_budget_for(municipality))
+
+    prompt = generator.generate_prompt(
+        layers_formatted, context.text, question_request.question
+    )
+
+    articles = context.articles
+
+    return parsed_properties, articles, prompt, None
 
-    all_relevant_chunks = retriever.retrieve(layers_formatted, enriched_articles, k=5)
 
-    return all_relevant_chunks
+QUOTA_EXCEEDED_DETAIL = "You have reached the maximum number of questions for this month. Please try again next month."
+
+
+def quota_exceeded():
+    # A new exception per request: a shared instance would carry one
+    # request's traceback and context into another's
+    return HTTPException(status_code=403, detail=QUOTA_EXCEEDED_DETAIL)
+
+
+async def release_question(user_id):
+    """Refund a reserved question on its own session."""
+    async with AsyncSessionLocal() as db:
+        await refund_question(db, user_id)
+
+
+async def save_response(user, question_request, articles, answer):
+    """Queue the answer for storage; its question was already reserved."""
+    await response_writer.submit(
+        dict(
+            user=user["id"],
+            question=question_request.question,
+            coordinates=[
+                question_request.coords.lat,
+                question_request.coords.lon,
+            ],
+            municipality=question_request.coords.municipality,
+            articles="\n".join(articles),
+            answer=answer,
+        )
+    )
+
+
+async def _cache_answer(municipality, parsed_properties, question, answer):
+    try:
+        await answer_cache.set_async(municipality, parsed_properties, question, answer)
+    except Exception:
+        logger.warning("Failed to cache answer", exc_info=True)
+
+
+def cache_answer(municipality, parsed_properties, question, answer):
+    """
+    Store a generated answer in the background. The cache is best-effort:
+    a failed write is logged and never fails the request that produced it.
+    """
+    task = asyncio.ensure_future(
+        _cache_answer(municipality, parsed_properties, question, answer)
+    )
+    pending_cache_writes.add(task)
+    task.add_done_callback(pending_cache_writes.discard)
+
+
+async def lookup_properties(coords):
+    # The first request for a municipality may have to fetch its capabilities
+    wms_service = await run_blocking("io", WMService, coords.municipality)
+    return await wms_service.get_properties_async(coords)
+
+
+async def answer_batch_group(job, user, batch_request, group, semaphore):
+    """
+    Answer every question for the locations of one classification group.
+
+    The articles are retrieved and packed once for the group (once per set
+    of cited articles for questions that cite some); each question is then
+    answered from the cache or generated once, and the answer is
+    given to every location in the group. Only generated answers are charged.
+    """
+    municipality = group["municipality"]
+    parsed_properties = group["parsed_properties"]
+    # Packed contexts by the articles the question cites, built on first use
+    contexts = {}
+    context_lock = asyncio.Lock()
+
+    async def fail(question_index, detail, refund):
+        # Never raises, so one item's failure cannot abort the whole group
+        for location_index, _ in group["locations"]:
+            job.fail(location_index, question_index, detail)
+        if refund:
+            try:
+                await release_question(user["id"])
+            except Exception:
+                logger.exception("Failed to refund batch question")
+
+    async def answer(question_index, question):
+        cached_answer = None
+        if not batch_request.fresh:
+            try:
+                cached_answer = await answer_cache.get_async(
+                    municipality, parsed_properties, question
+                )
+            except Exception:
+                logger.warning("Failed to read the answer cache", exc_info=True)
+        generated = cached_answer is None
+
+        if cached_answer is None:
+            async with semaphore:
+                try:
+                    async with AsyncSessionLocal() as db:
+                        reserved = await reserve_question(db, user["id"])
+                except Exception:
+                    logger.exception("Failed to reserve batch question")
+                    await fail(question_index, "Generation failed", refund=False)
+                    return
+                if not reserved:
+                    await fail(question_index, QUOTA_EXCEEDED_DETAIL, refund=False)
+                    return
+
+                try:
+                    citations = tuple(cited_articles(question))
+                    async with context_lock:
+                        if citations not in contexts:
+                            relevant_chunks = await get_all_relevant_chunks(
+                                parsed_properties, municipality, question
+                            )
+                            contexts[citations] = pack_context(
+                                relevant_chunks, token_budget_for(municipality)
+                            )
+                    context = contexts[citations]
+                    prompt = generator.generate_prompt(
+                        "\n".join(parsed_properties), context.text, question
+                    )
+                    cached_answer = {
+                        "articles": context.articles,
+                        "answer": await generator.generate_async(prompt),
+                    }
+                except Exception:
+                    logger.exception("Failed to answer batch question")
+                    await fail(question_index, "Generation failed", refund=True)
+                    return
+                except BaseException:
+                    await asyncio.shield(release_question(user["id"]))
+                    raise
+
+        try:
+            for location_index, properties in group["locations"]:
+                await save_response(
+                    user,
+                    QuestionRequest(
+                        question=question,
+                        properties=properties,
+                        coords=batch_request.locations[location_index],
+                    ),
+                    cached_answer["articles"],
+                    cached_answer["answer"],
+                )
+        except Exception:
+            logger.exception("Failed to store batch answer")
+            await fail(question_index, "Failed to store the answer", refund=generated)
+            return
+        except BaseException:
+            if generated:
+                await asyncio.shield(release_question(user["id"]))
+            raise
+
+        if generated:
+            job.generated += 1
+            cache_answer(municipality, parsed_properties, question, cached_answer)
+        for location_index, _ in group["locations"]:
+            job.complete(location_index, question_index, cached_answer)
+
+    await asyncio.gather(
+        *(
+            answer(question_index, question)
+            for question_index, question in enumerate(batch_request.questions)
+        )
+    )
+
+
+async def run_batch(job, user, batch_request):
+    """
+    Answer every (location, question) pair of a batch job.
+
+    Repeated locations share one WMS lookup, locations with the same
+    municipality and PDM classifications share retrieval and answers, and
+    the embeddings the batch needs are requested in a single call.
+    Generation runs at most BATCH_GENERATION_CONCURRENCY at a time.
+    """
+    job.status = "running"
+    try:
+        locations = batch_request.locations
+        question_count = len(batch_request.questions)
+
+        lookups = {}
+        for location_index, coords in enumerate(locations):
+            lookups.setdefault(
+                (coords.municipality, coords.lat, coords.lon, coords.margin), []
+            ).append(location_index)
+        results = await asyncio.gather(
+            *(lookup_properties(locations[indexes[0]]) for indexes in lookups.values()),
+            return_exceptions=True,
+        )
+
+        groups = {}
+        for indexes, properties in zip(lookups.values(), results):
+            if isinstance(properties, Exception) or not properties:
+                if isinstance(properties, Exception):
+                    logger.warning("Batch WMS lookup failed: %s", properties)
+                    detail = "Failed to get properties for the given coordinates"
+                else:
+                    detail = "No properties found for the given coordinates"
+                for location_index in indexes:
+                    for question_index in range(question_count):
+                        job.fail(location_index, question_index, detail)
+                continue
+
+            parsed_properties = parse_properties_for_model(properties)
+            municipality = locations[indexes[0]].municipality
+            group = groups.setdefault(
+                (municipality, tuple(sorted(set(parsed_properties)))),
+                {
+                    "municipality": municipality,
+                    "parsed_properties": parsed_properties,
+                    "locations": [],
+                },
+            )
+            group["locations"].extend((index, properties) for index in indexes)
+        job.groups = len(groups)
+
+        # Warm the embedding cache for retrieval and the answer cache at once
+        texts = {
+            text for group in groups.values() for text in group["parsed_properties"]
+        }
+        if not batch_request.fresh and answer_cache.semantic_enabled:
+            texts.update(normalize_question(q) for q in batch_request.questions)
+        if texts:
+            await vectorizer.get_text_embedding_async(sorted(texts))
+
+        semaphore = asyncio.Semaphore(BATCH_GENERATION_CONCURRENCY)
+        await asyncio.gather(
+            *(
+                answer_batch_group(job, user, batch_request, group, semaphore)
+                for group in groups.values()
+            )
+        )
+        job.finish()
+    except Exception:
+        logger.exception("Batch job %s failed", job.id)
+        job.finish("failed")
 
 
 @app.post("/ask_question/")
 async def ask_question(
-    request: Request, question_request: QuestionRequest, db: Session = Depends(get_db)
+    request: Request,
+    question_request: QuestionRequest,
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Answer a question based on the given coordinates and context.
 
+    The question is counted against the user's monthly limit before any work
+    is done, and refunded if no answer could be produced.
+
     Args:
         question_request (QuestionRequest): The question and coordinates.
 
@@ -164,76 +605,200 @@ async def ask_question(
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    parsed_properties = parse_properties_for_model(question_request.properties)
+    require_municipality(question_request.coords.municipality)
 
-    layers_formatted = "\n".join(parsed_properties)
+    # user["id"] should correspond to Prisma's user ID
+    if not await reserve_question(db, user["id"]):
+        raise quota_exceeded()
 
-    relevant_chunks = get_all_relevant_chunks(parsed_properties)
+    try:
+        parsed_properties, articles, prompt, response = await build_answer_context(
+            question_request
+        )
 
-    logger.info("Generating prompt...")
+        if response is None:
+            logger.debug("Generating response...")
+            response = await generator.generate_async(prompt)
 
-    prompt = generator.generate_prompt(
-        layers_formatted, relevant_chunks, question_request.question
-    )
+            cache_answer(
+                question_request.coords.municipality,
+                parsed_properties,
+                question_request.question,
+                {"articles": articles, "answer": response},
+            )
 
-    articles = [x.splitlines()[2] for x in relevant_chunks]
-
-    logger.info("Generating response...")
-    response = generator.generate(prompt)
-
-    logger.info("Saving response to database...")
-    db_response = Response(
-        user=user["id"],
-        question=question_request.question,
-        coordinates=[
-            question_request.coords.lat,
-            question_request.coords.lon,
-        ],
-        municipality=question_request.coords.municipality,
-        articles="\n".join(articles),
-        answer=response,
-    )
+        await save_response(user, question_request, articles, response)
+    except BaseException:
+        await db.rollback()
+        await asyncio.shield(release_question(user["id"]))
+        raise
 
-    db.add(db_response)
-    db.commit()
-    db.refresh(db_response)
+    return {"articles": articles, "answer": response}
 
-    # Update the user's request count logic
-    user_id = user["id"]  # user["id"] should correspond to Prisma's user ID
 
-    # Fetch or create UserRequestCount for this user
-    user_request_count = (
-        db.query(UserRequestCount).filter(UserRequestCount.user_id == user_id).first()
-    )
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    if not user_request_count:
-        # If the user doesn't have an entry, create one
-        user_request_count = UserRequestCount(
-            user_id=user_id, questions_asked=0, last_reset=datetime.utcnow()
+
+@app.post("/ask_question/stream")
+async def ask_question_stream(request: Request, question_request: QuestionRequest):
+    """
+    Answer a question like /ask_question/, streamed as server-sent events.
+
+    The retrieved articles are sent first ("articles" event), followed by the
+    answer as it is generated ("token" events) and a final "done" event. The
+    question is counted before streaming starts and refunded if the client
+    disconnects or generation fails; the response is only stored once the
+    answer is complete.
+
+    Args:
+        question_request (QuestionRequest): The question and coordinates.
+
+    Returns:
+        StreamingResponse: A text/event-stream response.
+    """
+
+    user = request.scope.get("user")
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    require_municipality(question_request.coords.municipality)
+
+    async with AsyncSessionLocal() as db:
+        if not await reserve_question(db, user["id"]):
+            raise quota_exceeded()
+
+    try:
+        parsed_properties, articles, prompt, cached_answer = await build_answer_context(
+            question_request
         )
-        db.add(user_request_count)
-        db.commit()
+    except BaseException:
+        await asyncio.shield(release_question(user["id"]))
+        raise
+
+    async def events():
+        try:
+            yield sse_event("articles", articles)
 
-    # Reset the count if the month has changed
-    user_request_count.reset_count_if_needed()
+            if cached_answer is not None:
+                answer = cached_answer
+                yield sse_event("token", answer)
+            else:
+                logger.debug("Streaming response...")
+                parts = []
+                async for delta in generator.generate_stream(prompt):
+                    parts.append(delta)
+                    yield sse_event("token", delta)
+                answer = "".join(parts)
+
+                cache_answer(
+                    question_request.coords.municipality,
+                    parsed_properties,
+                    question_request.question,
+                    {"articles": articles, "answer": answer},
+                )
+
+            await save_response(user, question_request, articles, answer)
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.info("Client disconnected, discarding partial answer")
+            # The request's task is being cancelled, so refund from a new one
+            refund = asyncio.ensure_future(release_question(user["id"]))
+            pending_refunds.add(refund)
+            refund.add_done_callback(pending_refunds.discard)
+            raise
+        except Exception:
+            logger.exception("Failed to answer question")
+            await release_question(user["id"])
+            yield sse_event(
+                "error", {"status_code": 500, "detail": "Generation failed"}
+            )
+            return
+
+        yield sse_event("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask_batch/", status_code=202)
+async def ask_batch(request: Request, batch_request: BatchRequest):
+    """
+    Start answering every question for every location, as a background job.
 
-    # Check if the user has exceeded the question limit
+    Locations are grouped by their PDM classification so that lookups,
+    retrieval and answers are shared within the batch. Each generated answer
+    counts as one question against the user's monthly limit; answers served
+    from the cache are free. Poll GET /ask_batch/{job_id} for progress.
 
-    if user_request_count.questions_asked >= user_request_count.limit:
+    Args:
+        batch_request (BatchRequest): The locations and the questions.
+
+    Returns:
+        dict: The job id and the number of (location, question) items.
+    """
+
+    user = request.scope.get("user")
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    for municipality in {coords.municipality for coords in batch_request.locations}:
+        require_municipality(municipality)
+
+    total = len(batch_request.locations) * len(batch_request.questions)
+    if total == 0:
+        raise HTTPException(
+            status_code=422,
+            detail="At least one location and one question are required",
+        )
+    if total > BATCH_MAX_ITEMS:
         raise HTTPException(
-            status_code=403,
-            detail="You have reached the maximum number of questions for this month. Please try again next month.",
+            status_code=422,
+            detail=f"A batch can have at most {BATCH_MAX_ITEMS} location-question pairs",
         )
 
-    # Increment the number of questions asked
-    user_request_count.questions_asked += 1
-    db.commit()
+    job = BatchJob(
+        user["id"], len(batch_request.locations), len(batch_request.questions)
+    )
+    batch_jobs.add(job)
 
-    return {"articles": articles, "answer": response}
+    task = asyncio.create_task(run_batch(job, user, batch_request))
+    batch_tasks.add(task)
+    task.add_done_callback(batch_tasks.discard)
+
+    return {"job_id": job.id, "total": total}
+
+
+@app.get("/ask_batch/{job_id}")
+async def get_batch(job_id: str, request: Request):
+    """
+    Get the progress of a batch job and the answers completed so far.
+
+    Each result has the location and question indexes of its item and either
+    articles and answer, or an error.
+
+    Raises:
+        HTTPException: If the job does not exist, has expired or belongs to
+        another user.
+    """
+    user = request.scope.get("user")
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    job = batch_jobs.get(job_id, user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
+    return job.to_dict()
 
 
 @app.get("/request_count/")
-async def get_request_count(request: Request, db: Session = Depends(get_db)):
+async def get_request_count(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Get the request count for the authenticated user.
 
@@ -241,17 +806,16 @@ async def get_request_count(request: Request, db: Session = Depends(get_db)):
         dict: The request count and limit for the user.
     """
     user = request.scope.get("user")
-    logging.info(user)
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     user_id = user["id"]
-    logging.info(user_id)
     user_request_count = (
-        db.query(UserRequestCount).filter(UserRequestCount.user_id == user_id).first()
-    )
+        await db.execute(
+            select(UserRequestCount).filter(UserRequestCount.user_id == user_id)
+        )
+    ).scalar_one_or_none()
 
-    logging.info(user_request_count)
     if not user_request_count:
         raise HTTPException(status_code=404, detail="Request count not found for user")
 
@@ -262,31 +826,94 @@ async def get_request_count(request: Request, db: Session = Depends(get_db)):
     }
 
 
+RESPONSES_PAGE_SIZE = int(os.getenv("RESPONSES_PAGE_SIZE", 20))
+RESPONSES_MAX_PAGE_SIZE = 100
+
+# Columns of the history list; answers are fetched one at a time on demand
+RESPONSE_SUMMARY_COLUMNS = (
+    Response.id,
+    Response.question,
+    Response.municipality,
+    Response.coordinates,
+)
+
+
 @app.get("/responses/")
-async def get_responses(request: Request, db: Session = Depends(get_db)):
+async def get_responses(
+    request: Request,
+    cursor: Optional[int] = None,
+    limit: int = Query(RESPONSES_PAGE_SIZE, ge=1, le=RESPONSES_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
     """
-    Retrieve responses from the Response table based on the user ID extracted from the token.
+    List the authenticated user's responses, newest first, without answers.
+
+    Pages are keyed on the response id: pass the returned next_cursor to get
+    the following page, which reads only the (user, id) index range it needs.
+
+    Args:
+        cursor (int, optional): next_cursor of the previous page.
+        limit (int): Maximum number of responses per page.
 
     Returns:
-        List[Response]: A list of responses for the authenticated user.
+        dict: items (id, question, municipality, coordinates) and next_cursor,
+        which is None on the last page.
     """
-    logging.info("Request authentication info:")
-    logging.info(request.scope.get("user"))
     user = request.scope.get("user")
 
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    user_id = user["id"]
-    responses = db.query(Response).filter(Response.user == user_id).all()
+    query = select(*RESPONSE_SUMMARY_COLUMNS).filter(Response.user == user["id"])
+    if cursor is not None:
+        query = query.filter(Response.id < cursor)
+    # One extra row tells whether there is another page
+    rows = (await db.execute(query.order_by(Response.id.desc()).limit(limit + 1))).all()
+
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+
+    return {"items": items, "next_cursor": next_cursor}
+
 
-    return responses
+@app.get("/responses/{response_id}")
+async def get_response(
+    response_id: int, request: Request, db: AsyncSession = Depends(get_db)
+):
+    """
+    Retrieve one of the authenticated user's responses, including the answer.
+
+    Raises:
+        HTTPException: If the response does not exist or belongs to another user.
+    """
+    user = request.scope.get("user")
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    response = (
+        await db.execute(
+            select(Response).filter(
+                Response.id == response_id, Response.user == user["id"]
+            )
+        )
+    ).scalar_one_or_none()
+
+    if response is None:
+        raise HTTPException(status_code=404, detail="Response not found")
+
+    return response
+
+
+def require_municipality(municipality):
+    if municipality not in municipalities:
+        raise HTTPException(status_code=404, detail="Municipality not found")
 
 
 @app.get("/layers/{municipality}")
-async def get_layers(request: Request):
+async def get_layers(municipality: str, request: Request):
     """
-    Get the list of available layers from the WMS service.
+    Get the list of available layers from the municipality's WMS service.
 
     Returns:
         List[str]: A list of layer names available in the WMS service.
@@ -297,18 +924,22 @@ async def get_layers(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    wms = WMService(municipality="Porto")
+    require_municipality(municipality)
+    wms = await run_blocking("io", WMService, municipality)
     contents = wms.get_contents()
     return list(contents.keys())
 
 
 @app.get("/layer_info/{layer_name}")
-async def get_layer_info(layer_name: str, request: Request):
+async def get_layer_info(
+    layer_name: str, request: Request, municipality: str = "Porto"
+):
     """
     Get the attributes of a specific layer from the WMS service.
 
     Args:
         layer_name (str): The name of the layer to retrieve information for.
+        municipality (str): The municipality whose WMS serves the layer.
 
     Returns:
         dict: A dictionary containing the layer's keywords, title, name, and bounding box in WGS84 coordinates.
@@ -321,7 +952,8 @@ async def get_layer_info(layer_name: str, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    wms = WMService(municipality="Porto")
+    require_municipality(municipality)
+    wms = await run_blocking("io", WMService, municipality)
     contents = wms.get_contents()
 
     if layer_name not in contents:
@@ -349,9 +981,9 @@ async def get_properties(coords: Coordinates, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    wms_service = WMService(coords.municipality)
+    require_municipality(coords.municipality)
 
-    all_properties = wms_service.get_properties(coords)
+    all_properties = await lookup_properties(coords)
 
     if not all_properties:
         raise HTTPException(
@@ -361,6 +993,26 @@ async def get_properties(coords: Coordinates, request: Request):
     return all_properties
 
 
+@app.get("/ready")
+async def get_ready():
+    """
+    Readiness probe: 200 once the startup warm-up has finished, 503 before.
+
+    The body lists the startup phase times and how each resource loaded.
+    """
+    return JSONResponse(
+        status_code=200 if warmup.ready else 503, content=warmup.status()
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Stage latency histograms and cache counters in the Prometheus text format."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
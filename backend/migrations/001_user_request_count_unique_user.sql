@@ -0,0 +1,8 @@
+-- Quota reservations upsert on user_request_count.user_id, which needs a
+-- unique index. Merge any duplicate counters first, keeping the newest row.
+DELETE FROM user_request_count a
+USING user_request_count b
+WHERE a.user_id = b.user_id AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_user_request_count_user_id
+    ON user_request_count (user_id);
@@ -0,0 +1,3 @@
+-- Per-user history pages are read by (user, id) ranges, newest first.
+-- Built concurrently so the table stays writable; run it outside a transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_responses_user_id ON responses ("user", id);
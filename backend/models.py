@@ -5,24 +5,39 @@ from sqlalchemy import (
     Text,
     Float,
     DateTime,
-    create_engine,
+    Index,
+    JSON,
 )
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import os
 import logging
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 10))
+
+
+def async_database_url(url):
+    """Swap the synchronous driver of a database URL for its asyncio one."""
+    for prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix) :]
+    return url
 
 
 class Response(Base):
@@ -30,18 +45,23 @@ class Response(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user = Column(String, nullable=False)
-    coordinates = Column(ARRAY(Float), nullable=False)
+    # SQLite (local benchmarks) has no arrays and stores the pair as JSON
+    coordinates = Column(ARRAY(Float).with_variant(JSON, "sqlite"), nullable=False)
     municipality = Column(String, nullable=False)
     question = Column(Text, nullable=False)
     articles = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
 
+    # Serves the per-user history pages, newest first
+    __table_args__ = (Index("ix_responses_user_id", "user", "id"),)
+
 
 class UserRequestCount(Base):
     __tablename__ = "user_request_count"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String)  # String type to match Prisma User model
+    # String type to match Prisma User model; unique so quota updates can upsert
+    user_id = Column(String, unique=True, index=True)
     questions_asked = Column(Integer, default=0)
     last_reset = Column(DateTime, default=datetime.utcnow)
     limit = Column(Integer, default=100)
@@ -56,7 +76,16 @@ class UserRequestCount(Base):
 
 logging.info(f"Connecting to database at {DATABASE_URL}")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Used by the request handlers, so database round trips don't block the loop
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL), pool_size=DATABASE_POOL_SIZE
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 
-Base.metadata.create_all(bind=engine)
+async def create_tables():
+    """Create the database tables if they do not already exist."""
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
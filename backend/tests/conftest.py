@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The helpers import each other as top-level modules and read their data
+# files relative to the backend directory, as when the API is served
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+# models builds its engine on import (it connects on first use only); the
+# tests make their own databases
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'pdm_tests.db')}"
+)
@@ -0,0 +1,65 @@
+import asyncio
+
+from helpers.answer_cache import AnswerCache
+
+
+class SameVectorizer:
+    """Embeds every question to the same vector, the worst case for the cache."""
+
+    async def get_text_embedding_async(self, texts):
+        return [[1.0, 0.0, 0.0] for _ in texts]
+
+
+def make_cache(**kwargs):
+    return AnswerCache(SameVectorizer(), **kwargs)
+
+
+def get(cache, *args):
+    return asyncio.run(cache.get_async(*args))
+
+
+def put(cache, *args):
+    asyncio.run(cache.set_async(*args))
+
+
+def test_paraphrase_reuses_answer():
+    cache = make_cache()
+    put(cache, "Porto", ["Espaços Centrais"], "Qual a altura permitida?", "a")
+    assert get(cache, "Porto", ["Espaços Centrais"], "Que altura é permitida") == "a"
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_different_article_is_not_reused():
+    cache = make_cache()
+    put(cache, "Porto", ["Espaços Centrais"], "O que diz o Artigo 45.º?", "45")
+    assert get(cache, "Porto", ["Espaços Centrais"], "O que diz o Artigo 46.º?") is None
+    assert get(cache, "Porto", ["Espaços Centrais"], "O que diz o artigo 45?") == "45"
+
+
+def test_contrasting_word_is_not_reused():
+    cache = make_cache()
+    put(cache, "Porto", ["Espaços Centrais"], "Qual a altura máxima?", "max")
+    assert get(cache, "Porto", ["Espaços Centrais"], "Qual a altura mínima?") is None
+
+
+def test_other_classifications_are_not_reused():
+    cache = make_cache()
+    put(cache, "Porto", ["Espaços Centrais"], "Qual a altura permitida?", "a")
+    assert get(cache, "Porto", ["Espaços Verdes"], "Qual a altura permitida?") is None
+
+
+def test_semantic_entries_are_bounded_in_total():
+    cache = make_cache(maxsize=8)
+    for i in range(20):
+        put(cache, "Porto", [f"Classe {i % 4}"], f"Pergunta {i}", i)
+    assert len(cache.semantic) <= 8
+    assert len(cache.exact) <= 8
+
+
+def test_similarity_above_one_keeps_exact_matches_only():
+    cache = make_cache(similarity_threshold=1.01)
+    put(cache, "Porto", ["Espaços Centrais"], "Qual a altura permitida?", "a")
+    assert (
+        get(cache, "Porto", ["Espaços Centrais"], "  qual a altura permitida ") == "a"
+    )
+    assert get(cache, "Porto", ["Espaços Centrais"], "Que altura é permitida") is None
@@ -0,0 +1,41 @@
+from helpers.batch import BatchJob, BatchJobStore
+
+
+def test_results_fill_in_as_items_finish():
+    job = BatchJob("u1", location_count=2, question_count=3)
+    job.complete(1, 2, {"articles": ["Artigo 45.º"], "answer": "a"})
+    job.fail(0, 1, "Generation failed")
+
+    state = job.to_dict()
+    assert (state["status"], state["total"], state["completed"]) == ("pending", 6, 2)
+    assert state["failed"] == 1
+    assert state["results"] == [
+        {"location": 0, "question": 1, "error": "Generation failed"},
+        {"location": 1, "question": 2, "articles": ["Artigo 45.º"], "answer": "a"},
+    ]
+
+
+def test_finish_records_status_and_time():
+    job = BatchJob("u1", location_count=1, question_count=1)
+    job.finish("failed")
+    assert job.status == "failed"
+    assert job.finished_at >= job.created_at
+
+
+def test_jobs_are_only_visible_to_their_owner():
+    store = BatchJobStore()
+    job = BatchJob("u1", location_count=1, question_count=1)
+    store.add(job)
+    assert store.get(job.id, "u1") is job
+    assert store.get(job.id, "u2") is None
+    assert store.get("missing", "u1") is None
+
+
+def test_jobs_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("helpers.cache.time.time", lambda: now[0])
+    store = BatchJobStore(ttl=60)
+    job = BatchJob("u1", location_count=1, question_count=1)
+    store.add(job)
+    now[0] += 61
+    assert store.get(job.id, "u1") is None
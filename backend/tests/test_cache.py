@@ -0,0 +1,64 @@
+import threading
+
+from helpers.cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("helpers.cache.time.time", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set("default", 1)
+    cache.set("longer", 2, ttl=60)
+    now[0] += 30
+    assert cache.get("default", "missing") == "missing"
+    assert cache.get("longer") == 2
+    assert len(cache) == 1
+
+
+def test_counters_and_cached_falsy_values():
+    cache = LRUCache()
+    cache.set("empty", [])
+    assert cache.get("empty") == []
+    assert cache.get("absent") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_delete_and_invalidate():
+    cache = LRUCache()
+    for key in [("Porto", 1), ("Porto", 2), ("Lisboa", 1)]:
+        cache.set(key, key)
+    assert cache.delete(("Porto", 1))
+    assert not cache.delete(("Porto", 1))
+    assert cache.invalidate(lambda key: key[0] == "Porto") == 1
+    assert cache.get(("Lisboa", 1)) == ("Lisboa", 1)
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_concurrent_writers_keep_the_size_bound():
+    cache = LRUCache(maxsize=50)
+
+    def writer(offset):
+        for i in range(500):
+            cache.set(offset + i, i)
+            cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
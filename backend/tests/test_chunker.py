@@ -0,0 +1,75 @@
+import re
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from helpers.chunker import ChunkingRules, PDFChunker  # noqa: E402
+
+START_MARKER = "Republicação do Regulamento do Plano Diretor Municipal do Porto"
+PAGE_HEADER = (
+    r"N\.º 20\s+27 de janeiro de 2023\s+Pág\. .*?\s+"
+    r"Diário da República, 2\.\ª série\s+PARTE .*"
+)
+
+PAGES = [
+    "Sumário do aviso\nArtigo 1.º\nEste artigo precede o início e é ignorado.\n"
+    + START_MARKER
+    + "\nTÍTULO I\nDisposições gerais\nArtigo 1.º\nÂmbito\nO presente regulamento",
+    "N.º 20 27 de janeiro de 2023 Pág. 2\nDiário da República, 2.ª série PARTE H\n"
+    "aplica-se a todo o concelho.\nArtigo 2.º\nDefinições\nPara efeitos do plano.\n"
+    "CAPÍTULO I\nSolo urbano\nSECÇÃO I\nEspaços centrais\nArtigo 3.º\nAltura",
+    "N.º 20 27 de janeiro de 2023 Pág. 3\nDiário da República, 2.ª série PARTE H\n"
+    "máxima de doze metros.\nSUBSECÇÃO I\nArtigo 4.º\nEstacionamento\n"
+    "Um lugar por fogo.\nArtigo 5.º\nDisposição final\nEntra em vigor.\nANEXOS\n"
+    "Anexo I",
+]
+
+
+def split_like_the_original(pdf_path):
+    """The splitter the chunker replaced: whole text, split, then cleaned."""
+    text = "".join(page.get_text("text") for page in fitz.open(pdf_path))
+    text = text.split(START_MARKER)[1]
+    pattern = r"Artigo[\s\S]*?(?=TÍTULO|CAPÍTULO|SECÇÃO|SUBSECÇÃO|Artigo|ANEXOS)"
+    return [re.sub(PAGE_HEADER, "", match) for match in re.findall(pattern, text)]
+
+
+@pytest.fixture(scope="module")
+def pdf_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("pdf") / "regulamento.pdf"
+    document = fitz.open()
+    for text in PAGES:
+        document.new_page().insert_text((50, 72), text, fontsize=10)
+    document.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def rules():
+    return ChunkingRules(
+        start_marker=START_MARKER,
+        page_header=PAGE_HEADER,
+        article=r"Artigo",
+        boundary=r"TÍTULO|CAPÍTULO|SECÇÃO|SUBSECÇÃO|Artigo|ANEXOS",
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_articles_match_the_original_splitter(pdf_path, rules, workers):
+    articles = list(PDFChunker(pdf_path, rules=rules).iter_articles(workers))
+    assert [article.text for article in articles] == split_like_the_original(pdf_path)
+
+
+def test_articles_carry_their_title_and_start_page(pdf_path, rules):
+    articles = list(PDFChunker(pdf_path, rules=rules).iter_articles(workers=1))
+    assert [(article.title, article.page) for article in articles] == [
+        ("Artigo 1.º", 1),
+        ("Artigo 2.º", 2),
+        ("Artigo 3.º", 2),
+        ("Artigo 4.º", 3),
+        ("Artigo 5.º", 3),
+    ]
+    # An article spanning a page break loses the page header in between
+    assert "aplica-se a todo o concelho" in articles[0].text
+    assert "Diário da República" not in articles[0].text
+    assert "máxima de doze metros" in articles[2].text
@@ -0,0 +1,51 @@
+from helpers.context import count_tokens, pack_context, parse_chunk
+
+SECTION = "TITULO II - USO DO SOLO"
+
+
+def chunk(number, body, section=SECTION):
+    return f"{section}\nArtigo {number}.º\n{body}"
+
+
+def test_parse_chunk_splits_breadcrumb_heading_and_body():
+    section, title, number, body = parse_chunk(chunk(12, "Texto  do artigo"))
+    assert (section, title, number, body) == (
+        SECTION,
+        "Artigo 12.º",
+        12,
+        "Texto do artigo",
+    )
+
+
+def test_articles_are_laid_out_by_number_with_one_breadcrumb():
+    packed = pack_context([(chunk(9, "Nove."), 0.9), (chunk(3, "Três."), 0.5)])
+    assert packed.articles == ["Artigo 3.º", "Artigo 9.º"]
+    assert packed.text.count(SECTION) == 1
+    assert packed.text.index("Três.") < packed.text.index("Nove.")
+    assert packed.dropped == 0
+
+
+def test_articles_that_do_not_fit_are_dropped_by_relevance():
+    long_body = "palavra " * 400
+    ranked = [chunk(1, "Curto."), chunk(2, long_body), chunk(3, "Também curto.")]
+    budget = count_tokens(long_body) // 2
+    packed = pack_context(ranked, token_budget=budget)
+    assert packed.articles == ["Artigo 1.º", "Artigo 3.º"]
+    assert packed.dropped == 1
+    assert packed.tokens <= budget
+
+
+def test_most_relevant_article_is_truncated_rather_than_dropped():
+    body = "\n".join(f"{i} — linha do artigo." for i in range(200))
+    packed = pack_context([chunk(5, body)], token_budget=100)
+    assert packed.articles == ["Artigo 5.º"]
+    assert packed.tokens <= 100
+    assert "0 — linha do artigo." in packed.text
+    assert "199 — linha do artigo." not in packed.text
+
+
+def test_pdf_boilerplate_is_removed():
+    body = "Texto bem -estar \nsegue.\nN.º 20 27 de janeiro de 2023 Pág. 12 Diário da República, 2.ª série PARTE H"
+    packed = pack_context([chunk(4, body)])
+    assert "bem-estar segue." in packed.text
+    assert "Diário da República" not in packed.text
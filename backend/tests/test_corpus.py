@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+from helpers.corpus import ChunkStore, build_offsets
+
+
+def write_chunks(path, chunks):
+    path.write_bytes("\n\n".join(chunks).encode("utf-8"))
+    return str(path)
+
+
+def test_offsets_match_splitting_on_blank_lines(tmp_path):
+    chunks = ["Artigo 1.º\nEspaços centrais", "Artigo 2.º\nÁrea verde", "", "fim"]
+    path = write_chunks(tmp_path / "chunks.txt", chunks)
+    data = open(path, "rb").read()
+    assert [data[s:e].decode("utf-8") for s, e in build_offsets(path)] == chunks
+
+
+def test_empty_file_has_one_empty_chunk(tmp_path):
+    path = write_chunks(tmp_path / "chunks.txt", [])
+    store = ChunkStore(path)
+    assert len(store) == 1 and store[0] == ""
+    store.close()
+
+
+def test_store_decodes_chunks_on_demand_and_saves_offsets(tmp_path):
+    chunks = ["Artigo 1.º\nÂmbito", "Artigo 2.º\nDefinições", "Artigo 3.º\nUso"]
+    path = write_chunks(tmp_path / "chunks.txt", chunks)
+    store = ChunkStore(path)
+    assert len(store) == 3
+    assert store[1] == chunks[1]
+    assert list(store) == chunks
+    store.close()
+
+    saved = np.load(f"{path}.offsets.npy")
+    assert (saved == build_offsets(path)).all()
+
+
+def test_stale_offsets_are_rebuilt(tmp_path):
+    path = write_chunks(tmp_path / "chunks.txt", ["a", "b"])
+    ChunkStore(path).close()
+    write_chunks(tmp_path / "chunks.txt", ["a", "b", "c"])
+    offsets_path = f"{path}.offsets.npy"
+    # Older than the chunk file it describes
+    os.utime(offsets_path, (0, 0))
+    store = ChunkStore(path)
+    assert list(store) == ["a", "b", "c"]
+    store.close()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from helpers.embedding_store import EmbeddingStore, embedding_key
+
+
+def test_keys_depend_on_model_and_text():
+    key = embedding_key("mistral-embed", "Espaços centrais")
+    assert key == embedding_key("mistral-embed", "Espaços centrais")
+    assert key != embedding_key("mistral-embed", "Espaços verdes")
+    assert key != embedding_key("other-embed", "Espaços centrais")
+
+
+def test_vectors_survive_a_new_process(tmp_path):
+    path = str(tmp_path / "cache" / "embeddings.sqlite3")
+    EmbeddingStore(path).put_many("mistral-embed", [("a", [1.0, 2.0]), ("b", [3, 4])])
+
+    store = EmbeddingStore(path)
+    found = store.get_many(["a", "b", "c"])
+    assert sorted(found) == ["a", "b"]
+    assert found["b"].dtype == np.float32
+    np.testing.assert_array_equal(found["a"], [1.0, 2.0])
+    # Read from disk once, then served from memory
+    assert store.get_many(["a"], disk=False).keys() == {"a"}
+
+
+def test_memory_only_lookups_skip_the_disk(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    EmbeddingStore(path).put_many("mistral-embed", [("a", [1.0])])
+    assert EmbeddingStore(path).get_many(["a"], disk=False) == {}
+
+
+def test_store_without_a_path_keeps_vectors_in_memory():
+    store = EmbeddingStore(path=None, memory_size=2)
+    assert not store.persistent
+    store.put_many("mistral-embed", [("a", [1.0]), ("b", [2.0]), ("c", [3.0])])
+    assert sorted(store.get_many(["a", "b", "c"])) == ["b", "c"]
+    assert store.stats()["evictions"] == 1
+
+
+def test_many_keys_are_read_in_batches(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    items = [(str(i), [float(i)]) for i in range(1200)]
+    EmbeddingStore(path).put_many("mistral-embed", items)
+    found = EmbeddingStore(path).get_many([key for key, _ in items])
+    assert len(found) == 1200
+    assert found["1199"][0] == 1199.0
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from helpers.faiss_index import build_index, read_index  # noqa: E402
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).random((200, 32), dtype=np.float32)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "fp16", "sq8"])
+def test_mapped_index_does_not_own_its_codes(tmp_path, vectors, index_type):
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(build_index(vectors, index_type), path)
+
+    mapped = read_index(path, mmap=True)
+    loaded = read_index(path)
+    assert not mapped.codes.is_owned
+    assert loaded.codes.is_owned
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat"])
+def test_mapped_index_searches_like_a_loaded_one(tmp_path, vectors, index_type):
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(build_index(vectors, index_type), path)
+
+    _, expected = read_index(path).search(vectors[:5], 3)
+    _, found = read_index(path, mmap=True).search(vectors[:5], 3)
+    assert (found == expected).all()
@@ -0,0 +1,109 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from helpers import feature_store
+from helpers.feature_store import (
+    LocalFeatureStore,
+    capabilities_fingerprint,
+    get_feature_store,
+)
+
+SQUARE = [[[0.0, 0.0], [0.01, 0.0], [0.01, 0.01], [0.0, 0.01], [0.0, 0.0]]]
+# A square with a square hole in the middle
+RING = [
+    [[0.02, 0.0], [0.05, 0.0], [0.05, 0.03], [0.02, 0.03], [0.02, 0.0]],
+    [[0.03, 0.01], [0.04, 0.01], [0.04, 0.02], [0.03, 0.02], [0.03, 0.01]],
+]
+
+
+class FakeWMS:
+    def __init__(self, xml):
+        self.xml = xml
+
+    def getServiceXML(self):
+        return self.xml
+
+
+def write_snapshot(path, harvested_at=None, xml=b"<capabilities/>"):
+    snapshot = {
+        "municipality": "Testville",
+        "harvested_at": time.time() if harvested_at is None else harvested_at,
+        "capabilities_fingerprint": capabilities_fingerprint(FakeWMS(xml)),
+        "layers": {
+            "PDM:zoning": [
+                {"properties": {"id": 1}, "polygons": [SQUARE]},
+                {"properties": {"id": 2}, "polygons": [RING]},
+            ],
+            "PDM:heritage": [{"properties": {"id": 3}, "polygons": [SQUARE]}],
+        },
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalFeatureStore(write_snapshot(tmp_path / "features.json.gz"))
+
+
+def ids(results, layer_name):
+    return [properties["id"] for properties in results[layer_name]]
+
+
+def test_query_returns_the_features_containing_the_point(store):
+    results = store.query(0.005, 0.005, ["PDM:zoning", "PDM:heritage"])
+    assert ids(results, "PDM:zoning") == [1]
+    assert ids(results, "PDM:heritage") == [3]
+
+    assert ids(store.query(0.025, 0.015, ["PDM:zoning"]), "PDM:zoning") == [2]
+    assert store.query(0.2, 0.2, ["PDM:zoning"]) == {"PDM:zoning": []}
+
+
+def test_holes_are_outside(store):
+    assert store.query(0.035, 0.015, ["PDM:zoning"]) == {"PDM:zoning": []}
+
+
+def test_only_harvested_layers_are_answered(store):
+    results = store.query(0.005, 0.005, ["PDM:zoning", "PDM:roads"])
+    assert list(results) == ["PDM:zoning"]
+
+
+def test_snapshot_is_stale_when_old_or_the_capabilities_changed(tmp_path):
+    path = write_snapshot(tmp_path / "features.json.gz")
+    store = LocalFeatureStore(path)
+    assert store.is_fresh(FakeWMS(b"<capabilities/>"))
+    assert not store.is_fresh(FakeWMS(b"<capabilities version='2'/>"))
+
+    old = LocalFeatureStore(
+        write_snapshot(tmp_path / "old.json.gz", harvested_at=time.time() - 100)
+    )
+    assert not old.is_fresh(FakeWMS(b"<capabilities/>"), max_age=60)
+
+
+def test_capabilities_are_fingerprinted_once_per_document(store, monkeypatch):
+    wms = FakeWMS(b"<capabilities/>")
+    assert not store.checked(wms)
+    assert store.is_fresh(wms)
+    assert store.checked(wms)
+
+    monkeypatch.setattr(
+        feature_store,
+        "capabilities_fingerprint",
+        lambda wms: pytest.fail("fingerprinted twice"),
+    )
+    assert store.is_fresh(wms)
+
+
+def test_store_is_loaded_once_per_municipality(tmp_path, monkeypatch):
+    monkeypatch.setattr(feature_store, "_stores", {})
+    params = {"feature_snapshot_path": write_snapshot(tmp_path / "features.json.gz")}
+    store = get_feature_store("Testville", params)
+    assert get_feature_store("Testville", params) is store
+    assert feature_store.loaded_feature_store("Testville", params) is store
+
+    missing = {"feature_snapshot_path": str(tmp_path / "missing.json.gz")}
+    assert get_feature_store("Elsewhere", missing) is None
@@ -0,0 +1,59 @@
+from helpers.lexical import ArticleResolver, BM25Index, cited_articles, tokenize
+
+CHUNKS = [
+    "Artigo 1.º\nÂmbito e objetivos do Plano Diretor Municipal",
+    "Artigo 2.º\nEspaços centrais: altura máxima das edificações",
+    "Artigo 3.º\nEspaços verdes de fruição coletiva",
+    "Artigo 4.º\nEstacionamento em espaços centrais",
+]
+
+
+def test_tokenize_folds_accents_and_drops_stopwords_and_numbers():
+    assert tokenize("Os Espaços da Área 12") == ["espacos", "area"]
+
+
+def test_search_ranks_the_best_chunk_first():
+    hits = BM25Index(CHUNKS).search("altura máxima espaços centrais")
+    assert hits[0].chunk_id == 1
+    assert hits[0].confident
+    assert hits[1].chunk_id == 3
+    assert not hits[1].confident
+
+
+def test_partial_or_unknown_queries_are_not_confident():
+    index = BM25Index(CHUNKS)
+    assert not index.search("espaços")[0].confident
+    assert not index.search("estacionamento subterrâneo tarifado")[0].confident
+    assert index.search("ferrovia") == []
+
+
+def test_short_queries_are_never_confident():
+    # Two terms fully covered by one chunk still match others by chance
+    hits = BM25Index(CHUNKS).search("Espaços verdes")
+    assert hits[0].chunk_id == 2
+    assert not hits[0].confident
+
+
+def test_index_survives_a_round_trip_through_its_arrays():
+    index = BM25Index(CHUNKS)
+    restored = BM25Index.from_arrays(index.arrays())
+    for query in ["espaços centrais", "estacionamento", "plano diretor"]:
+        assert restored.search(query) == index.search(query)
+
+
+def test_cited_articles():
+    assert cited_articles("O que diz o Artigo 45.º?") == [45]
+    assert cited_articles("artigos 12.º e 13.º, e o art. 7") == [12, 13, 7]
+    assert cited_articles("arts. 3.º, 4.º e 3.º") == [3, 4]
+    assert cited_articles("Veja o Art.º 45.º e o artº 46") == [45, 46]
+    assert cited_articles("Qual a altura de 12 metros?") == []
+    assert cited_articles(None) == []
+
+
+def test_article_resolver_only_resolves_known_articles():
+    resolver = ArticleResolver(
+        {"Artigo 2.º": 10, "Artigo 4.º": 12, "Artigo 9.º": 20}, [1, 2, None, 4, 2]
+    )
+    assert resolver.resolve("Compare o artigo 4.º com o Artigo 2.º") == [3, 1]
+    # Listed but without a chunk, and with a chunk but not listed
+    assert resolver.resolve("Artigo 9.º e artigo 1.º") == []
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from helpers.quota import refund_question, reserve_question
+from models import Base, UserRequestCount
+
+
+def run_with_database(tmp_path, scenario):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/quota.db")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            await scenario(async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+async def counter(sessions, user_id):
+    async with sessions() as db:
+        return (
+            await db.execute(
+                select(UserRequestCount).where(UserRequestCount.user_id == user_id)
+            )
+        ).scalar_one()
+
+
+def test_first_question_creates_the_counter(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            assert await reserve_question(db, "ana")
+        row = await counter(sessions, "ana")
+        assert row.questions_asked == 1
+        assert row.limit == 100
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_limit_is_enforced_and_refund_gives_a_question_back(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(UserRequestCount(user_id="ana", questions_asked=1, limit=2))
+            await db.commit()
+            assert await reserve_question(db, "ana")
+            assert not await reserve_question(db, "ana")
+            await refund_question(db, "ana")
+            assert await reserve_question(db, "ana")
+        assert (await counter(sessions, "ana")).questions_asked == 2
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_refund_never_goes_below_zero(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(UserRequestCount(user_id="ana", questions_asked=0))
+            await db.commit()
+            await refund_question(db, "ana")
+        assert (await counter(sessions, "ana")).questions_asked == 0
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_new_month_resets_the_count(tmp_path):
+    async def scenario(sessions):
+        last_month = datetime.utcnow().replace(day=1) - timedelta(days=1)
+        async with sessions() as db:
+            db.add(
+                UserRequestCount(
+                    user_id="ana", questions_asked=5, limit=5, last_reset=last_month
+                )
+            )
+            await db.commit()
+            assert await reserve_question(db, "ana")
+        row = await counter(sessions, "ana")
+        assert row.questions_asked == 1
+        assert row.last_reset > last_month
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_concurrent_requests_take_the_last_slot_once(tmp_path):
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(UserRequestCount(user_id="ana", questions_asked=9, limit=10))
+            await db.commit()
+
+        async def reserve():
+            async with sessions() as db:
+                return await reserve_question(db, "ana")
+
+        results = await asyncio.gather(*(reserve() for _ in range(8)))
+        assert results.count(True) == 1
+        assert (await counter(sessions, "ana")).questions_asked == 10
+
+    run_with_database(tmp_path, scenario)
@@ -0,0 +1,111 @@
+import asyncio
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from helpers.response_writer import ResponseWriter
+from models import Base, Response
+
+
+def run_with_database(tmp_path, scenario):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/responses.db")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        try:
+            await scenario(async_sessionmaker(engine, expire_on_commit=False))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def row(i):
+    return dict(
+        user="ana",
+        question=f"Pergunta {i}",
+        coordinates=[41.15, -8.61],
+        municipality="Porto",
+        articles="Artigo 45.º",
+        answer="Resposta",
+    )
+
+
+async def stored(sessions):
+    async with sessions() as db:
+        return (await db.execute(select(func.count()).select_from(Response))).scalar()
+
+
+class CountingWriter(ResponseWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    async def _write(self, rows):
+        self.batches.append(len(rows))
+        await super()._write(rows)
+
+
+def test_rows_are_written_in_batches_after_the_flush_interval(tmp_path):
+    async def scenario(sessions):
+        writer = CountingWriter(sessions, batch_size=4, flush_interval=0.2)
+        await writer.start()
+        for i in range(6):
+            await writer.submit(row(i))
+        assert await stored(sessions) == 0
+
+        await asyncio.sleep(0.5)
+        assert await stored(sessions) == 6
+        assert writer.batches == [4, 2]
+        assert writer.stats()["written"] == 6
+        await writer.stop()
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_stop_flushes_queued_rows(tmp_path):
+    async def scenario(sessions):
+        writer = ResponseWriter(sessions, flush_interval=0.2)
+        await writer.start()
+        for i in range(3):
+            await writer.submit(row(i))
+        await writer.stop()
+        assert await stored(sessions) == 3
+        assert writer.stats()["queued"] == 0
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_sync_mode_and_full_queue_write_immediately(tmp_path):
+    async def scenario(sessions):
+        writer = ResponseWriter(sessions, mode="sync")
+        await writer.start()
+        await writer.submit(row(0))
+        assert await stored(sessions) == 1
+
+        writer = ResponseWriter(sessions, maxsize=1, flush_interval=0.2)
+        await writer.start()
+        await writer.submit(row(1))
+        await writer.submit(row(2))
+        assert await stored(sessions) == 2
+        assert writer.stats()["sync_writes"] == 1
+        await writer.stop()
+        assert await stored(sessions) == 3
+
+    run_with_database(tmp_path, scenario)
+
+
+def test_failed_batches_are_counted_and_do_not_block_shutdown(tmp_path):
+    class FailingWriter(ResponseWriter):
+        async def _write(self, rows):
+            raise RuntimeError("database down")
+
+    async def scenario(sessions):
+        writer = FailingWriter(sessions, flush_interval=0.01)
+        await writer.start()
+        for i in range(3):
+            await writer.submit(row(i))
+        await asyncio.wait_for(writer.stop(), timeout=5)
+        assert writer.stats()["failed"] == 3
+
+    run_with_database(tmp_path, scenario)
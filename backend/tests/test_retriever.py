@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from helpers.retriever import RRF_K, fuse_results, fuse_rankings
+
+
+def test_rrf_rewards_chunks_found_by_several_queries():
+    D = np.array([[0.1, 0.2, 0.3], [0.1, 0.2, 0.3]], dtype=np.float32)
+    I = np.array([[1, 2, 3], [4, 2, 5]])
+    ranked = fuse_results(D, I, fusion="rrf")
+    assert ranked[0] == (2, pytest.approx(2 / (RRF_K + 2)))
+    assert {chunk_id for chunk_id, _ in ranked} == {1, 2, 3, 4, 5}
+    assert len(ranked) == len({chunk_id for chunk_id, _ in ranked})
+
+
+def test_max_keeps_the_best_similarity_per_chunk():
+    D = np.array([[0.0, 1.0], [3.0, 0.5]], dtype=np.float32)
+    I = np.array([[7, 8], [8, 9]])
+    ranked = dict(fuse_results(D, I, fusion="max"))
+    assert ranked[7] == pytest.approx(1.0)
+    # Distances 1.0 and 3.0: the closer hit wins
+    assert ranked[8] == pytest.approx(1 / 2.0)
+    assert ranked[9] == pytest.approx(1 / 1.5)
+
+
+def test_missing_hits_are_skipped_and_results_capped():
+    D = np.zeros((1, 4), dtype=np.float32)
+    I = np.array([[3, -1, 1, -1]])
+    assert [chunk_id for chunk_id, _ in fuse_results(D, I)] == [3, 1]
+    assert len(fuse_results(D, I, max_results=1)) == 1
+
+
+def test_unknown_fusion_is_rejected():
+    with pytest.raises(ValueError):
+        fuse_results(np.zeros((1, 1)), np.array([[0]]), fusion="sum")
+
+
+def test_fuse_rankings_merges_id_lists():
+    ranked = fuse_rankings([[1, 2], [2, 3]], max_results=None)
+    assert [chunk_id for chunk_id, _ in ranked] == [2, 1, 3]
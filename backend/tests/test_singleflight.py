@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+from helpers.singleflight import SingleFlight
+
+
+class Upstream:
+    """A coroutine function that blocks until released, counting its calls."""
+
+    def __init__(self, result="ok", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def start_waiters(group, upstream, count):
+    upstream.release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(group.do_async("key", upstream)) for _ in range(count)
+    ]
+    # Let every waiter join the flight
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_async_callers_share_one_call():
+    async def scenario():
+        group = SingleFlight("test")
+        upstream = Upstream()
+        tasks = await start_waiters(group, upstream, 3)
+        upstream.release.set()
+        assert await asyncio.gather(*tasks) == ["ok"] * 3
+        assert upstream.calls == 1
+        assert group.stats() == {"calls": 1, "coalesced": 2, "in_flight": 0}
+
+    asyncio.run(scenario())
+
+
+def test_async_error_reaches_every_waiter():
+    async def scenario():
+        group = SingleFlight("test")
+        upstream = Upstream(error=ValueError("upstream failed"))
+        tasks = await start_waiters(group, upstream, 3)
+        upstream.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError] * 3
+        assert upstream.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_others_running():
+    async def scenario():
+        group = SingleFlight("test")
+        upstream = Upstream()
+        tasks = await start_waiters(group, upstream, 3)
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+
+        assert await asyncio.gather(*tasks[1:]) == ["ok", "ok"]
+        assert tasks[0].cancelled()
+        assert not upstream.cancelled
+        assert upstream.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_upstream_is_cancelled_when_the_last_waiter_goes():
+    async def scenario():
+        group = SingleFlight("test")
+        upstream = Upstream()
+        tasks = await start_waiters(group, upstream, 2)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert upstream.cancelled
+        assert group.stats()["in_flight"] == 0
+
+        # The next caller starts a new call rather than joining the cancelled one
+        tasks = await start_waiters(group, upstream, 1)
+        upstream.release.set()
+        assert await tasks[0] == "ok"
+        assert upstream.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_sync_callers_share_one_call_and_its_error():
+    group = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        started.set()
+        release.wait()
+        raise ValueError("upstream failed")
+
+    errors = []
+
+    def caller():
+        try:
+            group.do("key", upstream)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=caller) for _ in range(2)]
+    for thread in followers:
+        thread.start()
+    while group.coalesced < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(errors) == 3
+    assert len({id(e) for e in errors}) == 1
+
+
+def test_disabled_group_calls_every_time():
+    async def scenario():
+        group = SingleFlight("test", enabled=False)
+        upstream = Upstream()
+        tasks = await start_waiters(group, upstream, 3)
+        upstream.release.set()
+        await asyncio.gather(*tasks)
+        assert upstream.calls == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+import httpx
+import pytest
+
+from helpers import vectorizer as vectorizer_module
+from helpers.embedding_store import EmbeddingStore
+from helpers.vectorizer import TextVectorizer
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def flaky_vectorizer(monkeypatch, errors):
+    """A vectorizer whose embeddings calls raise the errors, then succeed."""
+    monkeypatch.setattr(vectorizer_module.time, "sleep", lambda delay: None)
+    vectorizer = TextVectorizer(api_key="test", store=EmbeddingStore(path=None))
+    vectorizer.calls = 0
+
+    def get_text_embedding(batch):
+        vectorizer.calls += 1
+        if errors:
+            raise errors.pop(0)
+        return [[1.0, 0.0] for _ in batch]
+
+    vectorizer.get_text_embedding = get_text_embedding
+    return vectorizer
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        APIError(429),
+        APIError(503),
+        httpx.ReadTimeout("timed out"),
+        httpx.ConnectError("connection refused"),
+    ],
+)
+def test_transient_errors_are_retried(monkeypatch, error):
+    vectorizer = flaky_vectorizer(monkeypatch, [error, error])
+    assert vectorizer._embed_batch_with_retry(["texto"]) == [[1.0, 0.0]]
+    assert vectorizer.calls == 3
+
+
+@pytest.mark.parametrize("error", [APIError(400), APIError(401), ValueError("bad")])
+def test_other_errors_are_raised_at_once(monkeypatch, error):
+    vectorizer = flaky_vectorizer(monkeypatch, [error])
+    with pytest.raises(type(error)):
+        vectorizer._embed_batch_with_retry(["texto"])
+    assert vectorizer.calls == 1
+
+
+def test_retries_are_bounded(monkeypatch):
+    vectorizer = flaky_vectorizer(monkeypatch, [APIError(429)] * 3)
+    with pytest.raises(APIError):
+        vectorizer._embed_batch_with_retry(["texto"], max_retries=2)
+    assert vectorizer.calls == 3
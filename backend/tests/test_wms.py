@@ -0,0 +1,301 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+from helpers import wms
+from helpers.wms import CapabilitiesEntry, LayerIndex, WMService
+
+Layer = namedtuple("Layer", ["title", "abstract", "boundingBoxWGS84"])
+FakeWMS = namedtuple("FakeWMS", ["contents"])
+Coordinates = namedtuple("Coordinates", ["lat", "lon", "margin"])
+
+# A heritage polygon of about 20 m, inside a layer covering the whole city
+HERITAGE = (-8.61100, 41.14700, -8.61080, 41.14720)
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+
+class FakeClient:
+    """Answers GetFeatureInfo with the heritage feature when the click is on it."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def get(self, url, params):
+        self.requests.append(params)
+        min_lon, min_lat, max_lon, max_lat = map(float, params["bbox"].split(","))
+        lon, lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+        features = []
+        if HERITAGE[0] <= lon <= HERITAGE[2] and HERITAGE[1] <= lat <= HERITAGE[3]:
+            features.append({"id": "heritage.1", "properties": {"id": 1}})
+        return FakeResponse({"type": "FeatureCollection", "features": features})
+
+
+def make_service(monkeypatch, **params):
+    config = {
+        "wms_url": "https://example.test/wms",
+        "wms_version": "1.1.1",
+        "image_width": 800,
+        "image_height": 600,
+        "info_format": "application/json",
+        **params,
+    }
+    monkeypatch.setattr(wms, "municipalities", {"Testville": config})
+
+    contents = {
+        "PDM:heritage": Layer(
+            "Heritage", "Classified heritage", (-8.7, 41.1, -8.5, 41.2)
+        )
+    }
+    wms.capabilities_cache._entries["Testville"] = CapabilitiesEntry(
+        FakeWMS(contents), time.time(), LayerIndex(contents)
+    )
+    client = FakeClient()
+    monkeypatch.setattr(wms.AsyncHTTPPool, "client_for", lambda self, url: client)
+    return WMService("Testville"), client
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    yield
+    wms.capabilities_cache.invalidate("Testville")
+    wms.invalidate_properties("Testville")
+    wms.multi_layer_rejected.discard("Testville")
+
+
+def click(lon, lat):
+    return Coordinates(lat=lat, lon=lon, margin=0.0001)
+
+
+def get_properties(service, coords):
+    return asyncio.run(service.get_properties_async(coords))
+
+
+def test_empty_clicks_nearby_do_not_hide_a_feature(monkeypatch):
+    monkeypatch.setattr(wms, "NEGATIVE_CACHE_RECHECK", 0.0)
+    service, client = make_service(monkeypatch)
+
+    for offset in (0.0005, 0.0010, 0.0015):
+        assert get_properties(service, click(-8.6109, 41.1471 + offset)) == {
+            "PDM:heritage": []
+        }
+
+    properties = get_properties(service, click(-8.6109, 41.1471))
+    assert [p["id"] for p in properties["PDM:heritage"]] == [1]
+    assert len(client.requests) == 4
+
+
+def test_known_empty_layer_is_skipped_in_its_cell(monkeypatch):
+    monkeypatch.setattr(wms, "NEGATIVE_CACHE_RECHECK", 0.0)
+    service, client = make_service(monkeypatch, negative_cache_cell_size=0.005)
+
+    # Different fine cells, same coarse cell
+    for offset in (0.0005, 0.0010, 0.0015):
+        get_properties(service, click(-8.6109, 41.1471 + offset))
+    get_properties(service, click(-8.6109, 41.1471 + 0.0020))
+    assert len(client.requests) == 3
+
+
+def test_recheck_clears_a_known_empty_cell(monkeypatch):
+    service, client = make_service(monkeypatch, negative_cache_cell_size=0.005)
+    monkeypatch.setattr(wms, "NEGATIVE_CACHE_RECHECK", 0.0)
+    for offset in (0.0005, 0.0010, 0.0015):
+        get_properties(service, click(-8.6109, 41.1471 + offset))
+
+    monkeypatch.setattr(wms, "NEGATIVE_CACHE_RECHECK", 1.0)
+    properties = get_properties(service, click(-8.6109, 41.1471))
+    assert [p["id"] for p in properties["PDM:heritage"]] == [1]
+
+    key = service._empty_key("PDM:heritage", click(-8.6109, 41.1471))
+    assert wms.empty_results_cache.get(key) is None
+
+
+def make_multi_service(monkeypatch):
+    service, _ = make_service(monkeypatch, feature_info_mode="multi")
+    contents = {
+        name: Layer(name, "", (-8.7, 41.1, -8.5, 41.2))
+        for name in ("PDM:heritage", "PDM:zoning")
+    }
+    service.wms = FakeWMS(contents)
+    return service
+
+
+def test_demultiplex_splits_features_by_layer(monkeypatch):
+    service = make_multi_service(monkeypatch)
+    response = FakeResponse(
+        {
+            "features": [
+                {"id": "zoning.7", "properties": {"id": 7}},
+                {"id": "heritage.1", "properties": {"id": 1}},
+            ]
+        }
+    )
+    results = dict(service._demultiplex(["PDM:heritage", "PDM:zoning"], response))
+    assert [p["id"] for p in results["PDM:heritage"]] == [1]
+    assert [p["id"] for p in results["PDM:zoning"]] == [7]
+    assert service._use_multi_layer(["PDM:heritage", "PDM:zoning"])
+
+
+def test_demultiplex_keeps_feature_count_per_layer(monkeypatch):
+    service = make_multi_service(monkeypatch)
+    response = FakeResponse(
+        {"features": [{"id": f"zoning.{i}", "properties": {"id": i}} for i in range(3)]}
+    )
+    results = dict(service._demultiplex(["PDM:heritage", "PDM:zoning"], response))
+    assert results["PDM:heritage"] == []
+    assert len(results["PDM:zoning"]) == 1
+
+
+def test_unattributable_features_disable_multi_layer(monkeypatch):
+    service = make_multi_service(monkeypatch)
+    response = FakeResponse({"features": [{"id": "grupo_pdm.3", "properties": {}}]})
+    assert service._demultiplex(["PDM:heritage", "PDM:zoning"], response) is None
+    assert not service._use_multi_layer(["PDM:heritage", "PDM:zoning"])
+
+
+def test_rejected_request_disables_multi_layer(monkeypatch):
+    service = make_multi_service(monkeypatch)
+    response = FakeResponse({"error": "LayerNotQueryable"}, status_code=400)
+    assert service._demultiplex(["PDM:heritage", "PDM:zoning"], response) is None
+    assert not service._use_multi_layer(["PDM:heritage", "PDM:zoning"])
+
+
+class FakeStore:
+    def __init__(self):
+        self.fingerprints = []
+
+    def checked(self, wms):
+        return bool(self.fingerprints)
+
+    def check(self, wms, fingerprint):
+        self.fingerprints.append(fingerprint)
+
+    def is_fresh(self, wms, max_age):
+        return True
+
+    def query(self, lon, lat, layer_names):
+        return {"PDM:heritage": [{"id": 1}]}
+
+
+def test_local_backend_fingerprints_capabilities_off_the_loop(monkeypatch):
+    service, client = make_service(monkeypatch, properties_backend="local")
+    store = FakeStore()
+    threads = []
+
+    def fingerprint(wms):
+        threads.append(threading.current_thread())
+        return "fingerprint"
+
+    monkeypatch.setattr(wms, "loaded_feature_store", lambda *args: store)
+    monkeypatch.setattr(wms, "get_feature_store", lambda *args: store)
+    monkeypatch.setattr(wms, "capabilities_fingerprint", fingerprint)
+
+    for _ in range(2):
+        properties = get_properties(service, click(-8.6109, 41.1471))
+        assert [p["id"] for p in properties["PDM:heritage"]] == [1]
+    assert store.fingerprints == ["fingerprint"]
+    assert threads[0] is not threading.main_thread()
+    assert client.requests == []
+
+
+class CountingCache(wms.CapabilitiesCache):
+    """Fetches a new entry per call, once release is set."""
+
+    def __init__(self, fail=False):
+        super().__init__(ttl=60, snapshot_dir=None)
+        self.fetches = 0
+        self.fail = fail
+        self.release = threading.Event()
+
+    def _fetch(self, municipality):
+        self.release.wait(5)
+        self.fetches += 1
+        if self.fail:
+            raise RuntimeError("capabilities unavailable")
+        entry = CapabilitiesEntry(FakeWMS({}), time.time(), LayerIndex({}))
+        self._entries[municipality] = entry
+        return entry
+
+
+def stale_entry():
+    return CapabilitiesEntry(FakeWMS({}), time.time() - 120, LayerIndex({}))
+
+
+def wait_for_refresh(cache):
+    cache.release.set()
+    deadline = time.time() + 5
+    while cache._refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert not cache._refreshing
+
+
+def test_fresh_capabilities_are_served_from_the_cache(monkeypatch):
+    monkeypatch.setattr(wms, "municipalities", {"Testville": {}})
+    cache = CountingCache()
+    entry = CapabilitiesEntry(FakeWMS({}), time.time(), LayerIndex({}))
+    cache._entries["Testville"] = entry
+    assert cache.get_entry("Testville") is entry
+    assert cache.fetches == 0 and not cache._refreshing
+
+
+def test_stale_capabilities_are_served_while_one_refresh_runs(monkeypatch):
+    monkeypatch.setattr(wms, "municipalities", {"Testville": {}})
+    cache = CountingCache()
+    stale = cache._entries["Testville"] = stale_entry()
+
+    # The refresh is blocked, so every caller gets the stale copy at once
+    assert all(cache.get_entry("Testville") is stale for _ in range(5))
+    wait_for_refresh(cache)
+
+    assert cache.fetches == 1
+    fresh = cache.get_entry("Testville")
+    assert fresh is not stale
+    assert cache.fetches == 1
+
+
+def test_failed_refresh_keeps_the_stale_copy(monkeypatch):
+    monkeypatch.setattr(wms, "municipalities", {"Testville": {}})
+    cache = CountingCache(fail=True)
+    stale = cache._entries["Testville"] = stale_entry()
+
+    assert cache.get_entry("Testville") is stale
+    wait_for_refresh(cache)
+    assert cache.get_entry("Testville") is stale
+    wait_for_refresh(cache)
+    assert cache.fetches == 2
+
+
+def test_per_municipality_ttl(monkeypatch):
+    monkeypatch.setattr(wms, "municipalities", {"Testville": {"capabilities_ttl": 600}})
+    cache = CountingCache()
+    stale = cache._entries["Testville"] = stale_entry()
+    assert cache.get_entry("Testville") is stale
+    assert not cache._refreshing
+
+
+def test_cold_capabilities_are_fetched_once(monkeypatch):
+    monkeypatch.setattr(wms, "municipalities", {"Testville": {}})
+    cache = CountingCache()
+    entries = []
+    threads = [
+        threading.Thread(target=lambda: entries.append(cache.get_entry("Testville")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    cache.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert cache.fetches == 1
+    assert len(entries) == 4 and all(entry is entries[0] for entry in entries)
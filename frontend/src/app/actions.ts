@@ -1,4 +1,4 @@
-import { QuestionResponse } from "@/types" // Ensure this is the correct import
+import { QuestionResponse, ResponsesPage } from "@/types" // Ensure this is the correct import
 import { getSession } from "next-auth/react";
 import { signIn } from "next-auth/react";
 import jwt from 'jsonwebtoken';
@@ -155,10 +155,11 @@ export async function askQuestion(lat: number, lon: number, municipality: string
   }
 }
 
-export async function getResponses(): Promise<QuestionResponse[]> {
+export async function getResponses(cursor?: number | null): Promise<ResponsesPage> {
   try {
     const { BACKEND_URL } = await fetchConfig();
-    const response = await fetchWithAuth(`${BACKEND_URL}/responses/`, {
+    const query = cursor ? `?cursor=${cursor}` : '';
+    const response = await fetchWithAuth(`${BACKEND_URL}/responses/${query}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
@@ -169,7 +170,7 @@ export async function getResponses(): Promise<QuestionResponse[]> {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
 
-    const data: QuestionResponse[] = await response.json();
+    const data: ResponsesPage = await response.json();
     return data;
   } catch (error) {
     console.error("Error in getResponses:", error);
@@ -177,6 +178,28 @@ export async function getResponses(): Promise<QuestionResponse[]> {
   }
 }
 
+export async function getResponse(id: string): Promise<QuestionResponse> {
+  try {
+    const { BACKEND_URL } = await fetchConfig();
+    const response = await fetchWithAuth(`${BACKEND_URL}/responses/${id}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const data: QuestionResponse = await response.json();
+    return data;
+  } catch (error) {
+    console.error("Error in getResponse:", error);
+    throw error;
+  }
+}
+
 
 export async function getResponseCount(): Promise<{ questions_asked: number; limit: number; last_reset: string }> {
   try {
@@ -3,25 +3,29 @@ import dynamic from "next/dynamic"
 import { useState, useEffect } from "react"
 import { getSession, signIn } from "next-auth/react"
 import { getResponses } from "@/app/actions"
-import { QuestionResponse } from "@/types" // Ensure this is the correct import
+import { QuestionResponseSummary } from "@/types" // Ensure this is the correct import
 import { FloatingAlert } from '@/components/FloatingAlert'
 const SimpleInteractionHistory = dynamic(() => import("@/components/HistoryComponent").then(mod => mod.SimpleInteractionHistory), { ssr: false })
 
 
 export default function HistoryPage() {
-  const [history, setQuestionHistory] = useState<QuestionResponse[]>([])
+  const [history, setQuestionHistory] = useState<QuestionResponseSummary[]>([])
+  const [nextCursor, setNextCursor] = useState<number | null>(null)
 
-  useEffect(() => {
-    const fetchResponses = async () => {
-      const session = await getSession()
-
-     const data = await getResponses()
-     setQuestionHistory(data)
-
-    }
+  const fetchResponses = async (cursor?: number | null) => {
+    const data = await getResponses(cursor)
+    setQuestionHistory(prev => cursor ? [...prev, ...data.items] : data.items)
+    setNextCursor(data.next_cursor)
+  }
 
+  useEffect(() => {
     fetchResponses()
   }, [])
 
-  return <SimpleInteractionHistory responses={history} />
+  return (
+    <SimpleInteractionHistory
+      responses={history}
+      onLoadMore={nextCursor ? () => fetchResponses(nextCursor) : undefined}
+    />
+  )
 }
\ No newline at end of file
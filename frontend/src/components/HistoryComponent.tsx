@@ -8,7 +8,8 @@ import { MapPin, ChevronDown, ChevronUp } from 'lucide-react'
 import { Button } from "@/components/ui/button"
 import { Header } from "@/components/Header"
 import { Footer } from "@/components/Footer"
-import { QuestionResponse } from '@/types'
+import { QuestionResponseSummary } from '@/types'
+import { getResponse } from '@/app/actions'
 import ReactMarkdown from 'react-markdown'
 import remarkGfm from 'remark-gfm'
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/ui/dialog"
@@ -17,15 +18,17 @@ import Map from './Map'
 const LOCAL_PDF_URL = '/pdm.pdf';
 
 interface SimpleInteractionHistoryProps {
-  responses: QuestionResponse[]
+  responses: QuestionResponseSummary[]
+  onLoadMore?: () => void
 }
 
 const cities = {
   Porto: [41.1579, -8.6291]
 } as const
 
-export function SimpleInteractionHistory({ responses }: SimpleInteractionHistoryProps) {
+export function SimpleInteractionHistory({ responses, onLoadMore }: SimpleInteractionHistoryProps) {
   const [openItems, setOpenItems] = useState<Set<string>>(new Set())
+  const [answers, setAnswers] = useState<Record<string, string>>({})
   const [showPDF, setShowPDF] = useState(false)
   const [pdfPage, setPdfPage] = useState(1)
   const [articlesPages, setArticlesPages] = useState<any>(null);
@@ -55,6 +58,12 @@ export function SimpleInteractionHistory({ responses }: SimpleInteractionHistory
   }
 
   const toggleItem = (id: string) => {
+    // Answers are not part of the history list, fetch them on first open
+    if (!(id in answers)) {
+      getResponse(id).then(response => {
+        setAnswers(prev => ({ ...prev, [id]: response.answer }))
+      })
+    }
     setOpenItems(prev => {
       const newSet = new Set(prev)
       if (newSet.has(id)) {
@@ -132,12 +141,17 @@ export function SimpleInteractionHistory({ responses }: SimpleInteractionHistory
                           ),
                         }}
                       >
-                        {addLinksToMarkdown(response.municipality, response.answer)}
+                        {addLinksToMarkdown(response.municipality, answers[response.id] ?? 'A carregar...')}
                       </ReactMarkdown>
                     </CollapsibleContent>
                   </div>
                 </Collapsible>
               ))}
+              {onLoadMore && (
+                <Button variant="outline" size="sm" className="w-full" onClick={onLoadMore}>
+                  Carregar mais
+                </Button>
+              )}
             </ScrollArea>
           </CardContent>
         </Card>
@@ -6,4 +6,11 @@ export interface QuestionResponse {
     answer: string
     articles: string[]
   }
+
+export type QuestionResponseSummary = Omit<QuestionResponse, 'answer' | 'articles'>
+
+export interface ResponsesPage {
+    items: QuestionResponseSummary[]
+    next_cursor: number | null
+  }
   
\ No newline at end of file